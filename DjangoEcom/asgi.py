@@ -3,6 +3,10 @@ ASGI config for DjangoEcom project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run it with uvicorn workers under gunicorn:
+
+    gunicorn DjangoEcom.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
@@ -12,5 +16,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoEcom.settings')
+os.environ.setdefault('ECOM_ASYNC_VIEWS', 'True')
+# requests run on short-lived threads here, persistent connections would pile up
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
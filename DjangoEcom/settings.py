@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 from decouple import config
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,12 +45,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ecom.middleware.RequestMetricsMiddleware',
+    'ecom.middleware.QueryWatchMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'ecom.middleware.StaticFilesMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ecom.middleware.ReplicaPinMiddleware',
+    'ecom.middleware.GuestCartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,7 +63,7 @@ ROOT_URLCONF = 'DjangoEcom.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'ecom.backends.templates.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,12 +84,79 @@ LOGIN_URL = '/login'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
+# DB_PROFILE picks the backend, persistent connections are kept for DB_CONN_MAX_AGE seconds
+DB_PROFILE = config('DB_PROFILE', default='sqlite')
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+DB_HEALTH_CHECKS = config('DB_HEALTH_CHECKS', default=True, cast=bool)
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER', default=''),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default=''),
+            'PORT': config('DB_PORT', default=''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'ecom.backends.sqlite3',
+            'NAME': config('DB_NAME', default=BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
+    }
+
+# Optional read replica: DB_REPLICA_NAME (sqlite) or DB_REPLICA_HOST (postgres) adds a 'replica'
+# alias that ecom.routers sends catalog reads and admin reports to
+DB_REPLICA_NAME = config('DB_REPLICA_NAME', default='')
+DB_REPLICA_HOST = config('DB_REPLICA_HOST', default='')
+DB_REPLICA_PIN_SECONDS = config('DB_REPLICA_PIN_SECONDS', default=5, cast=int)
+DB_REPLICA_ALIAS = None
+if DB_REPLICA_NAME or DB_REPLICA_HOST:
+    DB_REPLICA_ALIAS = 'replica'
+    DATABASES[DB_REPLICA_ALIAS] = dict(
+        DATABASES['default'],
+        **({'HOST': DB_REPLICA_HOST} if DB_PROFILE == 'postgres' else {'NAME': DB_REPLICA_NAME}),
+        TEST={'MIRROR': 'default'}
+    )
+DATABASE_ROUTERS = ['ecom.routers.ReplicaRouter']
+
+# applied to every new SQLite connection by ecom.db, an empty value leaves the pragma alone
+SQLITE_JOURNAL_MODE = config('SQLITE_JOURNAL_MODE', default='WAL')
+SQLITE_SYNCHRONOUS = config('SQLITE_SYNCHRONOUS', default='NORMAL')
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int)
+SQLITE_MMAP_SIZE = config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)
+SQLITE_IMMEDIATE_TRANSACTIONS = config('SQLITE_IMMEDIATE_TRANSACTIONS', default=True, cast=bool)
+
+# CACHE_BACKEND picks where cached catalog, cart-count and coupon entries live. 'sqlite' and
+# 'file' are shared by every worker on the host, 'locmem' is per process, 'redis' needs redis-py.
+CACHE_BACKEND = config('CACHE_BACKEND', default='sqlite')
+CACHE_LOCATION = config('CACHE_LOCATION', default='')
+CACHE_BACKENDS = {
+    'sqlite': ('ecom.backends.sqlite_cache.SQLiteCache', os.path.join(tempfile.gettempdir(), 'ecom-cache.sqlite3')),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.path.join(tempfile.gettempdir(), 'ecom-cache')),
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'ecom'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379'),
+}
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': CACHE_LOCATION or CACHE_BACKENDS[CACHE_BACKEND][1],
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='ecom'),
+        # bump to drop every cached entry at once, e.g. after a deploy that changes cached shapes
+        'VERSION': config('CACHE_VERSION', default=1, cast=int),
+        'TIMEOUT': 300,
     }
 }
+if CACHE_BACKEND != 'redis':
+    # redis evicts by itself and passes OPTIONS on to its client
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=100000, cast=int)}
+# `manage.py test` moves the default cache to a temporary location of its own
+TEST_RUNNER = 'ecom.test_runner.TestRunner'
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -130,6 +202,10 @@ STATICFILES_DIRS = [
 ]
 MEDIA_ROOT = os.path.join(BASE_DIR, "media_root")
 MEDIA_URL = "/media_root/"
+# Item images get resized copies at these widths, in each format, see ecom.thumbnails
+THUMBNAIL_WIDTHS = config('THUMBNAIL_WIDTHS', default='240,480,960', cast=lambda v: [int(w) for w in v.split(',')])
+THUMBNAIL_FORMATS = config('THUMBNAIL_FORMATS', default='webp,jpeg', cast=lambda v: v.split(','))
+THUMBNAIL_QUALITY = config('THUMBNAIL_QUALITY', default=80, cast=int)
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -139,3 +215,53 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 KEY_ID = config('KEY_ID')
 KEY_SECRET = config('KEY_SECRET')
+
+# Razorpay gateway client, point RAZORPAY_BASE_URL at `manage.py fake_gateway` to work offline
+RAZORPAY_BASE_URL = config('RAZORPAY_BASE_URL', default='https://api.razorpay.com/v1')
+RAZORPAY_CONNECT_TIMEOUT = config('RAZORPAY_CONNECT_TIMEOUT', default=3.05, cast=float)
+RAZORPAY_READ_TIMEOUT = config('RAZORPAY_READ_TIMEOUT', default=10, cast=float)
+RAZORPAY_MAX_RETRIES = config('RAZORPAY_MAX_RETRIES', default=2, cast=int)
+RAZORPAY_RETRY_BACKOFF = config('RAZORPAY_RETRY_BACKOFF', default=0.25, cast=float)
+RAZORPAY_POOL_SIZE = config('RAZORPAY_POOL_SIZE', default=10, cast=int)
+RAZORPAY_WEBHOOK_SECRET = config('RAZORPAY_WEBHOOK_SECRET', default='')
+
+# verified payments are queued in ecom.PaymentEvent and finalized by `manage.py runworker`
+PAYMENT_QUEUE_BATCH = config('PAYMENT_QUEUE_BATCH', default=50, cast=int)
+PAYMENT_QUEUE_MAX_ATTEMPTS = config('PAYMENT_QUEUE_MAX_ATTEMPTS', default=5, cast=int)
+PAYMENT_QUEUE_CLAIM_TIMEOUT = config('PAYMENT_QUEUE_CLAIM_TIMEOUT', default=300, cast=int)
+
+# slow work such as image resizing is queued in ecom.Job and run by `manage.py runworker`
+JOB_WORKER_PROCESSES = config('JOB_WORKER_PROCESSES', default=2, cast=int)
+JOB_BATCH = config('JOB_BATCH', default=10, cast=int)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_VISIBILITY_TIMEOUT = config('JOB_VISIBILITY_TIMEOUT', default=300, cast=int)
+JOB_RETRY_BACKOFF = config('JOB_RETRY_BACKOFF', default=10, cast=float)
+
+# Request metrics, see ecom.metrics: the share of requests measured, whether they get a
+# Server-Timing header, how often each process adds its numbers to the shared totals, and the
+# bearer token for /metrics (staff can read it without one)
+METRICS_SAMPLE_RATE = config('METRICS_SAMPLE_RATE', default=0.1, cast=float)
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=DEBUG, cast=bool)
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=10, cast=float)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Query checks for development and staging, see ecom.querywatch: a query shape run this many
+# times in one request, or a query this slow, is logged with its stack and reported per view
+QUERY_WATCH = config('QUERY_WATCH', default=False, cast=bool)
+QUERY_WATCH_REPEAT_THRESHOLD = config('QUERY_WATCH_REPEAT_THRESHOLD', default=3, cast=int)
+QUERY_WATCH_SLOW_MS = config('QUERY_WATCH_SLOW_MS', default=100, cast=float)
+QUERY_WATCH_REPORT_DIR = config('QUERY_WATCH_REPORT_DIR', default=os.path.join(tempfile.gettempdir(), 'ecom-query-reports'))
+
+# anonymous visitors' carts live in this signed cookie until they sign in, see ecom.guest_cart
+GUEST_CART_COOKIE = config('GUEST_CART_COOKIE', default='guest_cart')
+GUEST_CART_AGE = config('GUEST_CART_AGE', default=60 * 60 * 24 * 14, cast=int)
+GUEST_CART_MAX_LINES = config('GUEST_CART_MAX_LINES', default=30, cast=int)
+
+# most {slug, delta} operations one request to the cart API may carry
+CART_API_MAX_OPERATIONS = config('CART_API_MAX_OPERATIONS', default=50, cast=int)
+
+# Route the catalog and cart URLs to the async views, DjangoEcom/asgi.py turns this on
+ECOM_ASYNC_VIEWS = config('ECOM_ASYNC_VIEWS', default=False, cast=bool)
+
+# Serve Order.get_total from the persisted Order.total column kept current by the cart views
+ECOM_USE_STORED_ORDER_TOTAL = config('ECOM_USE_STORED_ORDER_TOTAL', default=False, cast=bool)
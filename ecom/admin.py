@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Item, OrderItem, Refund, Order, Address, Coupon
+from .models import Item, OrderItem, Refund, Order, Address, Coupon, PaymentEvent, Job
+from .routers import use_replica
 from django.contrib.auth import get_user_model
 
 
@@ -10,7 +11,19 @@ def refund_accepted_update(modeladmin, request, queryset):
 refund_accepted_update.short_description = "Update orders to refund granted"
 
 
-class OrderAdmin(admin.ModelAdmin):
+class ReportingAdmin(admin.ModelAdmin):
+    # change lists are reports, they read from the replica; actions and edits don't
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with use_replica():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+
+class OrderAdmin(ReportingAdmin):
     list_display = [
         'user',
         'ordered',
@@ -75,13 +88,53 @@ class AddressAdmin(admin.ModelAdmin):
     actions = [refund_accepted_update]
 
 
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(ReportingAdmin):
     list_display = ['__str__', 'ordered']
 
 
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = [
+        'payment_id',
+        'order',
+        'source',
+        'status',
+        'attempts',
+        'created_at',
+        'processed_at'
+    ]
+
+    list_filter = [
+        'status',
+        'source'
+    ]
+
+    search_fields = [
+        'payment_id',
+        'gateway_order_id'
+    ]
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = [
+        'task',
+        'status',
+        'attempts',
+        'run_after',
+        'created_at',
+        'finished_at'
+    ]
+
+    list_filter = [
+        'status',
+        'task'
+    ]
+
+
 admin.site.register(Item)
 admin.site.register(Refund)
 admin.site.register(Address, AddressAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Coupon)
+admin.site.register(PaymentEvent, PaymentEventAdmin)
+admin.site.register(Job, JobAdmin)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class EcomConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ecom'
+
+    def ready(self):
+        from . import db, metrics, querywatch, signals  # noqa: F401
@@ -0,0 +1,137 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.utils.decorators import classonlymethod
+
+from . import cart, views
+from .cards import acached_listing
+from .guest_cart import cart_for
+from .models import Item
+from .routers import use_primary
+
+# Django 4.0 has neither the async ORM nor async class-based views. Database work runs in
+# one sync_to_async hop per request, which is what the 4.1 async ORM methods do under the
+# hood too, and responses are TemplateResponses so the handler renders them off the loop.
+
+
+async def get_user(request):
+    # resolves the lazy request.user in a thread, it's safe to use on the loop afterwards;
+    # without a session cookie it's the anonymous user and no query is needed
+    if request.session.session_key is None:
+        return request.user
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def get_cart(request):
+    # the signed-in user's CartService or the visitor's guest cart
+    await get_user(request)
+    return cart_for(request)
+
+
+class AsyncViewMixin:
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # the 4.0 handler only awaits views that look like coroutine functions
+        view._is_coroutine = asyncio.coroutines._is_coroutine
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        # the cart views and the templates read request.user from the loop
+        await get_user(request)
+        response = super().dispatch(request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+
+class HomePageView(AsyncViewMixin, views.HomePageView):
+    async def get(self, request, *args, **kwargs):
+        searched = request.GET.get('searched')
+        if searched:
+            return await sync_to_async(self.render_search)(searched)
+        self.object_list = self.get_queryset()
+        context = await acached_listing(request.GET, self.build_listing)
+        return self.render_to_response(context)
+
+    async def post(self, request, *args, **kwargs):
+        searched = request.POST.get('searched', '')
+        return await sync_to_async(self.render_search)(searched)
+
+
+class ItemDetailView(AsyncViewMixin, views.ItemDetailView):
+    async def get(self, request, *args, **kwargs):
+        self.object = await sync_to_async(self.get_object)()
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+
+class CartView(AsyncViewMixin, views.CartView):
+    async def get(self, request, *args, **kwargs):
+        order = await sync_to_async((await get_cart(request)).load)()
+        if order is None:
+            messages.info(request, "You have no items in your cart")
+            return redirect("ecom:ecom_home")
+        return TemplateResponse(request, 'ecom/ecom_cart_items.html', {'object': order})
+
+
+async def add_to_cart(request, slug):
+    service = await get_cart(request)
+
+    @use_primary()
+    def add():
+        item = get_object_or_404(Item, slug=slug)
+        return service.add(item)
+
+    result = await sync_to_async(add)()
+    if result == cart.ADDED:
+        messages.info(request, "The item has been added to your cart.")
+    elif result == cart.CART_FULL:
+        messages.info(request, "Your cart is full, please sign in to add more items.")
+    return redirect("ecom:ecom_cart")
+
+
+async def buy_now(request, slug):
+    service = await get_cart(request)
+
+    @use_primary()
+    def add():
+        item = get_object_or_404(Item, slug=slug)
+        service.add(item)
+
+    await sync_to_async(add)()
+    return redirect("ecom:ecom_checkout")
+
+
+async def report_missing(request, slug, result):
+    return await sync_to_async(views.report_missing)(request, slug, result)
+
+
+async def remove_from_cart(request, slug):
+    result = await sync_to_async((await get_cart(request)).remove)(slug)
+    if result == cart.REMOVED:
+        messages.info(request, "This item has been removed from your cart.")
+        return redirect("ecom:ecom_cart")
+    return await report_missing(request, slug, result)
+
+
+async def increase_quantity(request, slug):
+    result = await sync_to_async((await get_cart(request)).increase)(slug)
+    if result == cart.UPDATED:
+        messages.info(request, "The item's quantity has been updated.")
+        return redirect("ecom:ecom_cart")
+    return await report_missing(request, slug, result)
+
+
+async def decrease_quantity(request, slug):
+    result = await sync_to_async((await get_cart(request)).decrease)(slug)
+    if result == cart.UPDATED:
+        messages.info(request, "This item's quantity has been updated.")
+        return redirect("ecom:ecom_cart")
+    if result == cart.REMOVED:
+        messages.info(request, "This item has been removed from your cart.")
+        return redirect("ecom:ecom_cart")
+    return await report_missing(request, slug, result)
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        # A deferred BEGIN takes the write lock at the first write, and when another
+        # connection holds it SQLite fails at once instead of waiting out the busy timeout.
+        # Taking it up front makes concurrent cart writers queue.
+        if settings.SQLITE_IMMEDIATE_TRANSACTIONS:
+            self.cursor().execute("BEGIN IMMEDIATE")
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,212 @@
+import hashlib
+import math
+import random
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Coupon, Item, Order
+
+CART_COUNT_TIMEOUT = 60 * 60 * 24
+STATS_TIMEOUT = None
+CARD_TIMEOUT = 60 * 60 * 24
+LISTING_TIMEOUT = 60 * 10
+COUPON_TIMEOUT = 60 * 60
+PAGE_TIMEOUT = 60 * 10
+# bump when ecom_product_card.html changes so stale markup isn't served after a deploy
+CARD_TEMPLATE_VERSION = 2
+# how long one process may hold a recompute lock, and how long others wait on it
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.05
+# XFetch's beta: above 1 refreshes earlier, 0 turns early refresh off
+EARLY_REFRESH_BETA = 1.0
+
+
+def make_key(namespace, *parts):
+    # CACHES' KEY_PREFIX and VERSION are added by the backend on top of this
+    return ':'.join([namespace, *map(str, parts)])
+
+
+def namespace_version(namespace):
+    # a timestamp rather than a counter, so a version lost to eviction can't come back
+    return cache.get_or_set(make_key('version', namespace), time.time_ns, None)
+
+
+def bump_namespace(namespace):
+    cache.set(make_key('version', namespace), time.time_ns(), None)
+
+
+def versioned_key(namespace, *parts):
+    return make_key(namespace, namespace_version(namespace), *parts)
+
+
+def lock_key(key):
+    return make_key('lock', key)
+
+
+def cached_value(key, beta=EARLY_REFRESH_BETA):
+    # (True, value) while the entry is fresh, else (False, stale entry or None). Entries are
+    # (value, compute time, expiry) and go stale a little early, with a probability that
+    # grows as expiry nears (XFetch).
+    entry = cache.get(key)
+    if entry is None:
+        return False, None
+    value, cost, expires = entry
+    if time.time() - cost * beta * math.log(1 - random.random()) < expires:
+        return True, value
+    return False, entry
+
+
+def get_or_compute(key, compute, timeout, stats_name=None, beta=EARLY_REFRESH_BETA):
+    # Stampede protection: one process recomputes under a lock while the others keep
+    # serving the entry it is about to replace, or wait a moment for it on a cold miss.
+    fresh, value = cached_value(key, beta)
+    token = uuid.uuid4().hex
+    acquired = False
+    if not fresh:
+        entry = value
+        acquired = cache.add(lock_key(key), token, LOCK_TIMEOUT)
+        if not acquired:
+            if entry is None:
+                entry = wait_for(key)
+            if entry is not None:
+                fresh, value = True, entry[0]
+    if fresh:
+        if stats_name:
+            record(stats_name, 'hits')
+        return value
+    if stats_name:
+        record(stats_name, 'misses')
+    try:
+        start = time.time()
+        value = compute()
+        expires = math.inf if timeout is None else start + timeout
+        cache.set(key, (value, time.time() - start, expires), timeout)
+    finally:
+        # the lock may be another process's, after a timed out wait or a compute that outlasted LOCK_TIMEOUT
+        if acquired and cache.get(lock_key(key)) == token:
+            cache.delete(lock_key(key))
+    return value
+
+
+def wait_for(key):
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def cart_count_key(user_id):
+    return make_key('cart_count', user_id)
+
+
+def stats_key(name, outcome):
+    return make_key('stats', name, outcome)
+
+
+def incr_counter(key, delta=1, timeout=STATS_TIMEOUT):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # incr raises when the key is missing; add() keeps the first writer
+        if not cache.add(key, delta, timeout):
+            cache.incr(key, delta)
+
+
+def record(name, outcome):
+    incr_counter(stats_key(name, outcome))
+
+
+def stats(name):
+    values = cache.get_many([stats_key(name, 'hits'), stats_key(name, 'misses')])
+    hits = values.get(stats_key(name, 'hits'), 0)
+    misses = values.get(stats_key(name, 'misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0
+    }
+
+
+def reset_stats(name):
+    cache.delete_many([stats_key(name, 'hits'), stats_key(name, 'misses')])
+
+
+def get_cart_count(user):
+    key = cart_count_key(user.pk)
+    count = cache.get(key)
+    if count is not None:
+        record('cart_count', 'hits')
+        return count
+    record('cart_count', 'misses')
+    count = Order.objects.filter(user=user, ordered=False).annotate(
+        lines=Count('items')
+    ).values_list('lines', flat=True).first() or 0
+    cache.set(key, count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def invalidate_cart_count(user):
+    invalidate_cart_count_for(user.pk)
+
+
+def invalidate_cart_count_for(user_id):
+    cache.delete(cart_count_key(user_id))
+
+
+def catalog_version():
+    # nanosecond timestamp of the last Item write, doubles as its modification time
+    return namespace_version('catalog')
+
+
+def bump_catalog_version():
+    bump_namespace('catalog')
+
+
+def card_key(item_id):
+    return make_key('card', CARD_TEMPLATE_VERSION, item_id)
+
+
+def invalidate_card(item_id):
+    cache.delete(card_key(item_id))
+
+
+def listing_key(params):
+    query = '&'.join(f"{name}={params.get(name, '')}" for name in ('sort', 'cursor', 'page'))
+    return make_key('listing', catalog_version(), query)
+
+
+def page_key(version, path):
+    return make_key('page', version, hashlib.sha1(path.encode()).hexdigest())
+
+
+def item_exists(version, slug):
+    # only an Item write changes the answer, and every one bumps the catalog version
+    key = make_key('item_exists', version, hashlib.sha1(slug.encode()).hexdigest())
+    exists = cache.get(key)
+    if exists is None:
+        exists = Item.objects.filter(slug=slug).exists()
+        cache.set(key, exists, PAGE_TIMEOUT)
+    return exists
+
+
+def coupon_key(code):
+    # codes are user input, hashing keeps the key short and free of spaces
+    return versioned_key('coupon', hashlib.sha1(code.encode()).hexdigest())
+
+
+def get_coupon(code):
+    # misses are cached too, so guessing codes doesn't reach the database
+    return get_or_compute(coupon_key(code), lambda: Coupon.objects.filter(code=code).first(),
+                          COUPON_TIMEOUT, 'coupon')
+
+
+def invalidate_coupons():
+    bump_namespace('coupon')
@@ -0,0 +1,32 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .cache import CARD_TIMEOUT, LISTING_TIMEOUT, card_key, get_or_compute, listing_key
+
+
+def render_cards(items):
+    keys = {item.pk: card_key(item.pk) for item in items}
+    cached = cache.get_many(list(keys.values()))
+    missing = {}
+    cards = []
+    for item in items:
+        card = cached.get(keys[item.pk])
+        if card is None:
+            card = render_to_string('ecom/ecom_product_card.html', {'item': item})
+            missing[keys[item.pk]] = card
+        cards.append(card)
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+    return mark_safe(''.join(cards))
+
+
+def cached_listing(params, build):
+    # the listing holds no per-user markup, so one copy serves every visitor
+    return get_or_compute(listing_key(params), build, LISTING_TIMEOUT, 'listing')
+
+
+async def acached_listing(params, build):
+    # the cache backend blocks, so hits and misses alike take one thread hop
+    return await sync_to_async(cached_listing)(params, build)
@@ -0,0 +1,195 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Prefetch, Value, When
+from django.utils import timezone
+
+from .cache import invalidate_cart_count
+from .models import Item, Order, OrderItem
+
+ADDED = 'added'
+ALREADY_IN_CART = 'already_in_cart'
+UPDATED = 'updated'
+REMOVED = 'removed'
+NOT_IN_CART = 'not_in_cart'
+NO_CART = 'no_cart'
+CART_FULL = 'cart_full'
+
+
+def cart_queryset():
+    line_items = OrderItem.objects.with_line_total().select_related('item').order_by('pk')
+    return Order.objects.with_total().select_related('coupon').prefetch_related(
+        Prefetch('items', queryset=line_items)
+    )
+
+
+def load_cart(user):
+    return cart_queryset().get(user=user, ordered=False)
+
+
+class UnknownItems(ValueError):
+    def __init__(self, slugs):
+        super().__init__(f"No items with the slugs {', '.join(sorted(slugs))}.")
+        self.slugs = slugs
+
+
+def parse_changes(operations):
+    # [{"slug": ..., "delta": ...}, ...] from the cart API, as the net delta per slug
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Expected a list of {slug, delta} operations.")
+    if len(operations) > settings.CART_API_MAX_OPERATIONS:
+        raise ValueError(f"At most {settings.CART_API_MAX_OPERATIONS} operations per request.")
+    changes = {}
+    for operation in operations:
+        slug = operation.get('slug') if isinstance(operation, dict) else None
+        delta = operation.get('delta') if isinstance(operation, dict) else None
+        if not isinstance(slug, str) or not isinstance(delta, int) or isinstance(delta, bool):
+            raise ValueError("Every operation needs a slug string and an integer delta.")
+        changes[slug] = changes.get(slug, 0) + delta
+    return {slug: delta for slug, delta in changes.items() if delta}
+
+
+def cart_summary(order):
+    # what the cart page shows, for the cart API's response
+    if order is None:
+        return {'lines': [], 'total': 0, 'count': 0}
+    lines = list(order.items.all())
+    return {
+        'lines': [
+            {'slug': line.item.slug, 'quantity': line.quantity, 'line_total': line.get_final_price(),
+             'saved': line.get_amount_saved() if line.item.discount_price else 0}
+            for line in lines
+        ],
+        'total': order.get_total(),
+        'count': len(lines),
+    }
+
+
+# Every mutation runs in one transaction and changes quantities with F() so concurrent
+# clicks can't overwrite each other. A racing second cart hits the unique_open_order
+# constraint and get_or_create falls back to the existing row.
+class CartService:
+    def __init__(self, user):
+        self.user = user
+
+    def open_orders(self):
+        return Order.objects.filter(user=self.user, ordered=False)
+
+    def lines(self, slug):
+        return OrderItem.objects.filter(
+            user=self.user, ordered=False, item__slug=slug,
+            order__user=self.user, order__ordered=False
+        )
+
+    def load(self):
+        try:
+            return load_cart(self.user)
+        except Order.DoesNotExist:
+            return None
+
+    def refresh_total(self):
+        self.open_orders().update_totals()
+
+    def missing(self):
+        return NOT_IN_CART if self.open_orders().exists() else NO_CART
+
+    def add(self, item):
+        with transaction.atomic():
+            order, _ = self.open_orders().select_for_update().get_or_create(
+                user=self.user, ordered=False,
+                defaults={'ordered_date': timezone.now()}
+            )
+            order_item, created = OrderItem.objects.get_or_create(item=item, user=self.user, ordered=False)
+            through = Order.items.through
+            if not created and through.objects.filter(order=order, orderitem=order_item).exists():
+                return ALREADY_IN_CART
+            through.objects.create(order=order, orderitem=order_item)
+            self.refresh_total()
+        invalidate_cart_count(self.user)
+        return ADDED
+
+    def increase(self, slug):
+        with transaction.atomic():
+            if self.lines(slug).update(quantity=F('quantity') + 1):
+                self.refresh_total()
+                return UPDATED
+        return self.missing()
+
+    def decrease(self, slug):
+        with transaction.atomic():
+            if self.lines(slug).filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+                self.refresh_total()
+                return UPDATED
+            removed = self.delete_lines(slug)
+        if removed:
+            invalidate_cart_count(self.user)
+            return REMOVED
+        return self.missing()
+
+    def remove(self, slug):
+        with transaction.atomic():
+            removed = self.delete_lines(slug)
+        if removed:
+            invalidate_cart_count(self.user)
+            return REMOVED
+        return self.missing()
+
+    def apply(self, changes):
+        """
+        Applies {slug: delta} to the quantities in one transaction, with a fixed number of
+        queries however many lines change. Lines that reach zero are removed and a positive delta
+        for an item that isn't in the cart adds it. Raises UnknownItems, changing nothing, when a
+        slug isn't an item.
+        """
+        if not changes:
+            return UPDATED
+        items = dict(Item.objects.filter(slug__in=changes).values_list('slug', 'pk'))
+        if len(items) < len(changes):
+            raise UnknownItems(set(changes) - set(items))
+        deltas = {items[slug]: delta for slug, delta in changes.items()}
+        through = Order.items.through
+        with transaction.atomic():
+            if any(delta > 0 for delta in deltas.values()):
+                order, _ = self.open_orders().select_for_update().get_or_create(
+                    user=self.user, ordered=False,
+                    defaults={'ordered_date': timezone.now()}
+                )
+            else:
+                order = self.open_orders().select_for_update().first()
+                if order is None:
+                    return NO_CART
+            # an open line can exist outside the cart, add() picks those up too
+            lines = OrderItem.objects.filter(user=self.user, ordered=False, item_id__in=deltas).annotate(
+                in_cart=Exists(through.objects.filter(order=order, orderitem=OuterRef('pk')))
+            ).values_list('item_id', 'pk', 'in_cart')
+            updates, attach = {}, []
+            for item_id, pk, in_cart in lines:
+                delta = deltas.pop(item_id)
+                if in_cart:
+                    updates[pk] = F('quantity') + delta
+                elif delta > 0:
+                    updates[pk] = Value(delta)
+                    attach.append(pk)
+            if updates:
+                OrderItem.objects.filter(pk__in=updates).update(quantity=Case(
+                    *[When(pk=pk, then=quantity) for pk, quantity in updates.items()], output_field=IntegerField()
+                ))
+            _, removed = OrderItem.objects.filter(
+                user=self.user, ordered=False, item_id__in=items.values(), quantity__lte=0
+            ).delete()
+            created = OrderItem.objects.bulk_create([
+                OrderItem(user=self.user, item_id=item_id, quantity=delta)
+                for item_id, delta in deltas.items() if delta > 0
+            ])
+            attach += [line.pk for line in created]
+            through.objects.bulk_create([through(order=order, orderitem_id=pk) for pk in attach])
+            self.refresh_total()
+        if attach or removed.get(OrderItem._meta.label):
+            invalidate_cart_count(self.user)
+        return UPDATED
+
+    def delete_lines(self, slug):
+        _, deleted = self.lines(slug).delete()
+        if not deleted.get(OrderItem._meta.label):
+            return False
+        self.refresh_total()
+        return True
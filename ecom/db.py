@@ -0,0 +1,48 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def sqlite_pragmas():
+    pragmas = {
+        'journal_mode': settings.SQLITE_JOURNAL_MODE,
+        'synchronous': settings.SQLITE_SYNCHRONOUS,
+        'busy_timeout': settings.SQLITE_BUSY_TIMEOUT,
+        'mmap_size': settings.SQLITE_MMAP_SIZE,
+    }
+    return {name: value for name, value in pragmas.items() if value not in ('', None)}
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    # Django 4.0 has no CONN_HEALTH_CHECKS: drop a persistent connection that went away
+    # while idle so the request opens a fresh one instead of failing on the first query
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for conn in connections.all():
+        if conn.connection is not None and conn.settings_dict['CONN_MAX_AGE'] and not conn.is_usable():
+            conn.close()
+
+
+def replicate_sqlite(source, target):
+    # replication stand-in for local two-file setups: an online copy of the primary
+    source_db = sqlite3.connect(settings.DATABASES[source]['NAME'])
+    target_db = sqlite3.connect(settings.DATABASES[target]['NAME'], timeout=settings.SQLITE_BUSY_TIMEOUT / 1000)
+    try:
+        source_db.backup(target_db)
+    finally:
+        target_db.close()
+        source_db.close()
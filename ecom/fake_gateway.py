@@ -0,0 +1,143 @@
+import hashlib
+import hmac
+import json
+import random
+import string
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def random_id(prefix):
+    return prefix + ''.join(random.choices(string.ascii_letters + string.digits, k=14))
+
+
+def sign(message, secret):
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between calls; without TCP_NODELAY
+    # the split header/body writes stall on delayed ACKs once a connection is reused
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        path = self.path.rstrip('/')
+        if path.endswith('/pay'):
+            # not part of the real API: completes checkout and answers with the signed callback
+            order_id = path.split('/')[-2]
+            if order_id not in self.server.orders:
+                self.send_json(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'Unknown order'}})
+                return
+            self.send_json(200, self.server.pay(order_id))
+            return
+        if not path.endswith('/orders'):
+            self.send_json(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'Not found'}})
+            return
+        if random.random() < self.server.failure_rate:
+            self.send_json(502, {'error': {'code': 'GATEWAY_ERROR', 'description': 'Simulated outage'}})
+            return
+        if not payload.get('amount'):
+            self.send_json(400, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'amount is required'}})
+            return
+        order = {
+            'id': random_id('order_'),
+            'entity': 'order',
+            'amount': payload['amount'],
+            'amount_paid': 0,
+            'amount_due': payload['amount'],
+            'currency': payload.get('currency', 'INR'),
+            'receipt': payload.get('receipt'),
+            'status': 'created',
+            'attempts': 0,
+            'created_at': int(time.time())
+        }
+        with self.server.lock:
+            self.server.orders[order['id']] = order
+        self.send_json(200, order)
+
+
+class FakeGateway(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, verbose=False,
+                 key_secret='', webhook_secret=''):
+        super().__init__((host, port), FakeGatewayHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.key_secret = key_secret
+        self.webhook_secret = webhook_secret
+        self.orders = {}
+        self.payments = {}
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # a client that timed out has hung up before the answer, which is what latency is for
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def pay(self, order_id):
+        # the form fields checkout posts back to the merchant once the customer has paid
+        with self.lock:
+            order = self.orders[order_id]
+            order.update(status='paid', amount_paid=order['amount'], amount_due=0, attempts=order['attempts'] + 1)
+            payment = {
+                'id': random_id('pay_'),
+                'entity': 'payment',
+                'amount': order['amount'],
+                'currency': order['currency'],
+                'status': 'captured',
+                'order_id': order_id,
+                'captured': True,
+                'created_at': int(time.time())
+            }
+            self.payments[payment['id']] = payment
+        return {
+            'razorpay_payment_id': payment['id'],
+            'razorpay_order_id': order_id,
+            'razorpay_signature': sign(f"{order_id}|{payment['id']}".encode(), self.key_secret)
+        }
+
+    def webhook(self, payment_id, event='payment.captured'):
+        # (raw body, X-Razorpay-Signature) of the webhook sent for a payment
+        body = json.dumps({
+            'entity': 'event',
+            'event': event,
+            'payload': {'payment': {'entity': self.payments[payment_id]}},
+            'created_at': int(time.time())
+        }).encode()
+        return body, sign(body, self.webhook_secret)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
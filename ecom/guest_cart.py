@@ -0,0 +1,156 @@
+import logging
+
+from django.conf import settings
+from django.core import signing
+
+from . import cart
+from .cart import CartService, UnknownItems
+from .models import Item, OrderItem
+
+logger = logging.getLogger(__name__)
+
+SALT = 'ecom.guest_cart'
+
+
+class GuestLines(list):
+    # stands in for Order.items in the cart template
+    def all(self):
+        return self
+
+
+class GuestOrder:
+    def __init__(self, lines):
+        self.items = GuestLines(lines)
+
+    def get_total(self):
+        return sum(line.get_final_price() for line in self.items)
+
+
+class GuestCart:
+    """
+    An anonymous visitor's cart: {slug: quantity} in a signed cookie, so browsing and filling a
+    cart write nothing to the database. It answers like CartService, GuestCartMiddleware writes
+    the cookie back and LoginPage merges it into the user's open Order.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.changed = False
+
+    @classmethod
+    def from_request(cls, request):
+        value = request.COOKIES.get(settings.GUEST_CART_COOKIE)
+        try:
+            lines = signing.loads(value, salt=SALT) if value else {}
+        except signing.BadSignature:
+            lines = {}
+        return cls(lines if isinstance(lines, dict) else {})
+
+    def set(self, slug, quantity):
+        if quantity > 0:
+            self.lines[slug] = quantity
+        else:
+            self.lines.pop(slug, None)
+        self.changed = True
+
+    def missing(self):
+        return cart.NOT_IN_CART if self.lines else cart.NO_CART
+
+    def add(self, item):
+        if item.slug in self.lines:
+            return cart.ALREADY_IN_CART
+        if len(self.lines) >= settings.GUEST_CART_MAX_LINES:
+            return cart.CART_FULL
+        self.set(item.slug, 1)
+        return cart.ADDED
+
+    def increase(self, slug):
+        if slug not in self.lines:
+            return self.missing()
+        self.set(slug, self.lines[slug] + 1)
+        return cart.UPDATED
+
+    def decrease(self, slug):
+        if slug not in self.lines:
+            return self.missing()
+        self.set(slug, self.lines[slug] - 1)
+        return cart.UPDATED if slug in self.lines else cart.REMOVED
+
+    def remove(self, slug):
+        if slug not in self.lines:
+            return self.missing()
+        self.set(slug, 0)
+        return cart.REMOVED
+
+    def apply(self, changes):
+        if not changes:
+            return cart.UPDATED
+        known = set(Item.objects.filter(slug__in=changes).values_list('slug', flat=True))
+        if len(known) < len(changes):
+            raise UnknownItems(set(changes) - known)
+        added = sum(1 for slug, delta in changes.items() if slug not in self.lines and delta > 0)
+        if len(self.lines) + added > settings.GUEST_CART_MAX_LINES:
+            raise ValueError(f"At most {settings.GUEST_CART_MAX_LINES} lines in a cart before signing in.")
+        for slug, delta in changes.items():
+            self.set(slug, self.lines.get(slug, 0) + delta)
+        return cart.UPDATED
+
+    def load(self):
+        if not self.lines:
+            return None
+        items = Item.objects.in_bulk(self.lines, field_name='slug')
+        return GuestOrder([
+            OrderItem(item=items[slug], quantity=quantity)
+            for slug, quantity in self.lines.items() if slug in items
+        ])
+
+    def clear(self):
+        if self.lines:
+            self.lines = {}
+            self.changed = True
+
+    def save(self, response):
+        if not self.changed:
+            return
+        if not self.lines:
+            response.delete_cookie(settings.GUEST_CART_COOKIE, samesite='Lax')
+            return
+        response.set_cookie(
+            settings.GUEST_CART_COOKIE, signing.dumps(self.lines, salt=SALT, compress=True),
+            max_age=settings.GUEST_CART_AGE, secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax'
+        )
+
+
+def get_guest_cart(request):
+    # one per request, GuestCartMiddleware saves it
+    if not hasattr(request, '_guest_cart'):
+        request._guest_cart = GuestCart.from_request(request)
+    return request._guest_cart
+
+
+def cart_for(request):
+    if request.user.is_authenticated:
+        return CartService(request.user)
+    return get_guest_cart(request)
+
+
+def merge(request, user):
+    # The guest's lines are added to the user's open Order in one CartService.apply. Signing in
+    # never fails over them: lines that can't be added are logged and the cookie goes either way.
+    guest = get_guest_cart(request)
+    if not guest.lines:
+        return
+    service = CartService(user)
+    lines = guest.lines
+    try:
+        try:
+            service.apply(lines)
+        except UnknownItems as e:
+            # items deleted since they were added
+            logger.info("Dropped deleted items %s from user %s's guest cart", sorted(e.slugs), user.pk)
+            lines = {slug: quantity for slug, quantity in lines.items() if slug not in e.slugs}
+            service.apply(lines)
+    except Exception:
+        logger.exception("Could not merge guest cart lines %s into user %s's cart", lines, user.pk)
+    finally:
+        guest.clear()
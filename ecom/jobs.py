@@ -0,0 +1,115 @@
+import functools
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+class ClaimLost(Exception):
+    # the visibility timeout ran out and another worker claimed the job
+    pass
+
+
+def task(atomic=False, max_attempts=None):
+    """
+    Mark a function as a background task, queued with func.delay(*args) and run by
+    `manage.py runworker`. Arguments are stored as JSON. An atomic task commits its writes
+    together with its job being marked done, so it takes effect at most once even if the
+    claim times out mid-run.
+    """
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.atomic = atomic
+        func.max_attempts = max_attempts
+        func.delay = functools.partial(enqueue, func)
+        return func
+    return decorator
+
+
+def enqueue(func, *args, delay=0):
+    # inside a transaction the job commits, or rolls back, with the writes that queued it
+    return Job.objects.create(task=func.task_name, args=list(args),
+                              run_after=timezone.now() + timedelta(seconds=delay))
+
+
+def claimable_jobs():
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT)
+    return Job.objects.filter(
+        Q(status=Job.PENDING, run_after__lte=now) | Q(status=Job.PROCESSING, claimed_at__lt=stale)
+    )
+
+
+def claim_jobs(limit):
+    # the same conditional UPDATE claim as ecom.orders.claim_payment_events
+    claimed = []
+    for pk in claimable_jobs().order_by('run_after', 'pk').values_list('pk', flat=True)[:limit]:
+        if claimable_jobs().filter(pk=pk).update(status=Job.PROCESSING, claimed_at=timezone.now(),
+                                                 attempts=F('attempts') + 1):
+            claimed.append(pk)
+    return list(Job.objects.filter(pk__in=claimed).order_by('run_after', 'pk'))
+
+
+def mark_done(job):
+    # only while the claim is still ours, a worker that lost it mustn't finish the job
+    return Job.objects.filter(pk=job.pk, status=Job.PROCESSING, claimed_at=job.claimed_at).update(
+        status=Job.DONE, error='', finished_at=timezone.now()
+    )
+
+
+def reschedule(job, error, max_attempts):
+    if job.attempts >= max_attempts:
+        fields = {'status': Job.FAILED, 'finished_at': timezone.now()}
+    else:
+        # exponential backoff: JOB_RETRY_BACKOFF seconds, then twice that, and so on
+        backoff = settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        fields = {'status': Job.PENDING, 'run_after': timezone.now() + timedelta(seconds=backoff)}
+    Job.objects.filter(pk=job.pk, claimed_at=job.claimed_at).update(error=repr(error), **fields)
+
+
+def run_job(job):
+    # True when the job ran, False when it failed and was rescheduled or given up on
+    try:
+        func = import_string(job.task)
+    except ImportError as e:
+        reschedule(job, e, max_attempts=0)
+        return False
+    try:
+        if func.atomic:
+            with transaction.atomic():
+                func(*job.args)
+                if not mark_done(job):
+                    raise ClaimLost(job.pk)
+        else:
+            func(*job.args)
+            mark_done(job)
+    except ClaimLost:
+        return False
+    except Exception as e:
+        reschedule(job, e, func.max_attempts or settings.JOB_MAX_ATTEMPTS)
+        return False
+    return True
+
+
+def release(jobs):
+    # hand claimed jobs that never started back to the queue
+    for job in jobs:
+        Job.objects.filter(pk=job.pk, status=Job.PROCESSING, claimed_at=job.claimed_at).update(
+            status=Job.PENDING, attempts=F('attempts') - 1
+        )
+
+
+def run_jobs(limit=None, stopping=None):
+    # stopping() is checked between jobs, a worker told to stop releases the rest of its batch
+    jobs = claim_jobs(limit or settings.JOB_BATCH)
+    for i, job in enumerate(jobs):
+        if stopping is not None and stopping():
+            release(jobs[i:])
+            break
+        run_job(job)
+    return len(jobs)
@@ -0,0 +1,4 @@
+def percentile(values, fraction):
+    # nearest rank, 0 for no values
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0
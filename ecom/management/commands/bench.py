@@ -0,0 +1,145 @@
+import json
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ecom.models import Item, Order, OrderItem
+from ecom.search import tokenize
+
+from ._stats import percentile
+
+BENCH_USER = 'bench-user'
+CART_LINES = 5
+
+
+class Command(BaseCommand):
+    help = ("Time the storefront pages and cart actions through the test client and record latency "
+            "percentiles and query counts as a JSON baseline, or compare against one. Run seed_catalog first.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help="Timed requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--scenario', action='append', dest='scenarios', help="Run only these, repeatable.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="A baseline written by --output to check the results against.")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="How much slower than the baseline's p50 counts as a regression.")
+
+    def handle(self, *args, **options):
+        items = list(Item.objects.order_by('pk')[:CART_LINES + 2])
+        if len(items) < CART_LINES + 2:
+            raise CommandError(f"Needs at least {CART_LINES + 2} items, run `manage.py seed_catalog` first.")
+        anonymous, client = Client(), Client()
+        client.force_login(self.bench_user(items[:CART_LINES]))
+        scenarios = self.scenarios(anonymous, client, items)
+        if options['scenarios']:
+            unknown = set(options['scenarios']) - set(scenarios)
+            if unknown:
+                raise CommandError(f"Unknown scenarios {sorted(unknown)}, choose from {sorted(scenarios)}")
+            scenarios = {name: steps for name, steps in scenarios.items() if name in options['scenarios']}
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, steps in scenarios.items():
+                results[name] = self.run(steps, options['warmup'], options['iterations'])
+                self.stdout.write(
+                    f"{name:18} p50 {results[name]['p50_ms']:7.2f} ms  p90 {results[name]['p90_ms']:7.2f} ms  "
+                    f"p99 {results[name]['p99_ms']:7.2f} ms  {results[name]['queries']:3} queries"
+                )
+        report = {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'items': Item.objects.count(),
+            'iterations': options['iterations'],
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write('\n')
+        if options['compare']:
+            self.compare(results, options['compare'], options['tolerance'])
+
+    def bench_user(self, items):
+        # the same cart at the start of every run, so runs stay comparable
+        user, _ = get_user_model().objects.get_or_create(username=BENCH_USER)
+        Order.objects.filter(user=user).delete()
+        OrderItem.objects.filter(user=user).delete()
+        order = Order.objects.create(user=user, ordered_date=timezone.now())
+        order.items.add(*OrderItem.objects.bulk_create([OrderItem(user=user, item=item) for item in items]))
+        order.update_total()
+        return user
+
+    def scenarios(self, anonymous, client, items):
+        # Each scenario is a list of (client, path) requests, one per iteration in turn; the cart
+        # actions come in pairs that undo each other, so the cart looks the same every time.
+        spare, carted = items[-1], items[0]
+        word = tokenize(items[0].title)[0]
+        return {
+            'home': [(anonymous, reverse('ecom:ecom_home'))],
+            'home_signed_in': [(client, reverse('ecom:ecom_home'))],
+            'detail': [(anonymous, item.get_absolute_url()) for item in items],
+            'search': [(anonymous, f"{reverse('ecom:ecom_home')}?searched={word}")],
+            'cart': [(client, reverse('ecom:ecom_cart'))],
+            'add_remove': [(client, spare.get_add_to_cart_url()), (client, spare.get_remove_from_cart_url())],
+            'increase_decrease': [(client, carted.get_increase_quantity_url()),
+                                  (client, carted.get_decrease_quantity_url())],
+            'checkout': [(client, reverse('ecom:ecom_checkout'))],
+        }
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.status_code not in (200, 302):
+            raise CommandError(f"GET {path} returned {response.status_code}")
+        # the cart actions leave a flash message that nothing here displays, don't let them pile up
+        client.cookies.pop('messages', None)
+
+    def run(self, steps, warmup, iterations):
+        for i in range(warmup):
+            self.request(*steps[i % len(steps)])
+        # queries are counted on a separate pass, capturing them slows the timed requests down
+        queries = []
+        for step in steps:
+            with CaptureQueriesContext(connection) as captured:
+                self.request(*step)
+            queries.append(len(captured))
+        timings = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            self.request(*steps[i % len(steps)])
+            timings.append(time.perf_counter() - start)
+        return {
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+            'p90_ms': round(percentile(timings, 0.9) * 1000, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+            'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+            'queries': max(queries),
+        }
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)['scenarios']
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            change = result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0
+            self.stdout.write(f"{name:18} p50 {change:+.0%}  queries {before['queries']} -> {result['queries']}")
+            if change > tolerance:
+                regressions.append(f"{name} p50 {before['p50_ms']} -> {result['p50_ms']} ms")
+            if result['queries'] > before['queries']:
+                regressions.append(f"{name} queries {before['queries']} -> {result['queries']}")
+        if regressions:
+            raise CommandError("Regressions against the baseline: " + '; '.join(regressions))
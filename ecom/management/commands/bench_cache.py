@@ -0,0 +1,60 @@
+import threading
+import time
+
+from django.core.cache import cache, caches
+from django.core.management.base import BaseCommand
+
+from ecom.cache import get_or_compute, make_key
+
+
+class Command(BaseCommand):
+    help = ("Time get/set on the configured cache and show how many of a burst of concurrent "
+            "cold misses recompute the same entry.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ops', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--compute-time', type=float, default=0.05, help="Seconds one recompute takes.")
+
+    def handle(self, *args, **options):
+        value = {'cards': '<div class="card">item</div>' * 10, 'is_paginated': True}
+        keys = [make_key('bench', i) for i in range(100)]
+        start = time.perf_counter()
+        for i in range(options['ops']):
+            cache.set(keys[i % 100], value, 60)
+        set_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(options['ops']):
+            cache.get(keys[i % 100])
+        get_time = time.perf_counter() - start
+        cache.delete_many(keys)
+        self.stdout.write(f"{caches['default'].__class__.__name__}: get {get_time / options['ops'] * 1e6:.0f} us, "
+                          f"set {set_time / options['ops'] * 1e6:.0f} us")
+
+        key = make_key('bench', 'stampede')
+        computes = []
+
+        def compute():
+            computes.append(1)
+            time.sleep(options['compute_time'])
+            return 'listing'
+
+        for label, protected in (('plain get/set', False), ('get_or_compute', True)):
+            cache.delete(key)
+            computes.clear()
+            barrier = threading.Barrier(options['threads'])
+
+            def worker():
+                barrier.wait()
+                if protected:
+                    get_or_compute(key, compute, 60)
+                elif cache.get(key) is None:
+                    cache.set(key, compute(), 60)
+
+            threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.stdout.write(f"{options['threads']} concurrent cold misses, {label}: {len(computes)} recomputes")
+        cache.delete(key)
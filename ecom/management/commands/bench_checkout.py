@@ -0,0 +1,93 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ecom.models import Item, Order, OrderItem
+from ecom.orders import create_ref_code, finalize_order
+
+
+def legacy_finalize(order):
+    order.ordered = True
+    order.ref_code = create_ref_code()
+    order_items = OrderItem.objects.all()
+    order_items.update(ordered=True)
+    for order_item in order_items:
+        order_item.save()
+    order.save()
+
+
+class Command(BaseCommand):
+    help = "Measure checkout finalization as the OrderItem table grows (data is rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000, 1000000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--cart-lines', type=int, default=5)
+        parser.add_argument('--legacy-max', type=int, default=10000,
+                            help="Largest table size the old save-every-row loop is run against.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'rows':>9} {'finalize ms':>12} {'legacy ms':>10}")
+        with transaction.atomic():
+            self.filler_user = get_user_model().objects.create(username='bench_checkout_filler')
+            self.user = get_user_model().objects.create(username='bench_checkout')
+            self.items = Item.objects.bulk_create([
+                Item(title=f'Checkout bench {i}', price=100 + i, category='S', label='P',
+                     slug=f'checkout-bench-{i}', description='bench', image='bench.jpg')
+                for i in range(options['cart_lines'])
+            ])
+            rows = 0
+            for size in sorted(options['sizes']):
+                self.fill(size - rows)
+                rows = size
+                finalize_ms = self.time(finalize_order, options)
+                legacy_ms = self.time(legacy_finalize, options) if size <= options['legacy_max'] else None
+                legacy = f"{legacy_ms:>10.2f}" if legacy_ms is not None else f"{'skipped':>10}"
+                self.stdout.write(f"{size:>9} {finalize_ms:>12.2f} {legacy}")
+            transaction.set_rollback(True)
+
+    def fill(self, count, chunk=10000, lines_per_order=100):
+        # raw inserts keep building a million ordered lines within seconds
+        item_id = self.items[0].pk
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            while count > 0:
+                batch = min(chunk, count)
+                cursor.executemany(
+                    "INSERT INTO ecom_orderitem (user_id, ordered, item_id, quantity) VALUES (%s, %s, %s, %s)",
+                    [(self.filler_user.pk, True, item_id, 1)] * batch
+                )
+                cursor.execute("SELECT MAX(id) FROM ecom_orderitem")
+                last_id = cursor.fetchone()[0]
+                orders = Order.objects.bulk_create([
+                    Order(user=self.filler_user, ordered=True, ordered_date=now)
+                    for _ in range(-(-batch // lines_per_order))
+                ])
+                cursor.executemany(
+                    "INSERT INTO ecom_order_items (order_id, orderitem_id) VALUES (%s, %s)",
+                    [(orders[i // lines_per_order].pk, line_id)
+                     for i, line_id in enumerate(range(last_id - batch + 1, last_id + 1))]
+                )
+                count -= batch
+
+    def open_cart(self):
+        order = Order.objects.create(user=self.user, ordered_date=timezone.now())
+        order.items.add(*OrderItem.objects.bulk_create([
+            OrderItem(user=self.user, item=item) for item in self.items
+        ]))
+        return order
+
+    def time(self, finalize, options):
+        timings = []
+        for _ in range(options['repeat']):
+            order = self.open_cart()
+            start = time.perf_counter()
+            finalize(order)
+            timings.append(time.perf_counter() - start)
+            # the legacy loop flags every open line, keep the next cart clean either way
+            OrderItem.objects.filter(user=self.user, ordered=False).update(ordered=True)
+        timings.sort()
+        return timings[len(timings) // 2] * 1000
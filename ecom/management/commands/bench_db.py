@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from ecom import cart
+from ecom.cart import CartService, load_cart
+from ecom.models import Item, Order, OrderItem
+
+from ._stats import percentile
+
+
+class Command(BaseCommand):
+    help = ("Run mixed cart reads and writes from several threads against the configured database "
+            "and report throughput, latency and lock errors.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run.")
+        parser.add_argument('--write-ratio', type=float, default=0.3)
+        parser.add_argument('--items', type=int, default=20)
+
+    def setup(self, threads, item_count):
+        User = get_user_model()
+        items = []
+        for i in range(item_count):
+            item, _ = Item.objects.get_or_create(
+                slug=f'bench-db-{i}',
+                defaults={'title': f'DB bench {i}', 'price': 10 + i, 'category': 'S', 'label': 'P',
+                          'description': 'db bench', 'image': 'db-bench.jpg'}
+            )
+            items.append(item)
+        users = [User.objects.get_or_create(username=f'bench_db_{i}')[0] for i in range(threads)]
+        Order.objects.filter(user__in=users).delete()
+        OrderItem.objects.filter(user__in=users).delete()
+        for user in users:
+            order = Order.objects.create(user=user, ordered_date=timezone.now())
+            order.items.add(*OrderItem.objects.bulk_create([OrderItem(user=user, item=item) for item in items[:5]]))
+            order.update_total()
+        return users, items
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError("Threads need a file-backed database.")
+        users, items = self.setup(options['threads'], options['items'])
+        connection.close()
+        results = {'read': [], 'write': []}
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(users))
+        deadline = [0.0]
+
+        def worker(user):
+            service = CartService(user)
+            rng = random.Random(user.pk)
+            timings = {'read': [], 'write': []}
+            try:
+                barrier.wait()
+                while time.perf_counter() < deadline[0]:
+                    kind = 'write' if rng.random() < options['write_ratio'] else 'read'
+                    start = time.perf_counter()
+                    try:
+                        if kind == 'write':
+                            item = rng.choice(items)
+                            if service.increase(item.slug) != cart.UPDATED:
+                                service.add(item)
+                        else:
+                            order = load_cart(user)
+                            order.get_total()
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    timings[kind].append(time.perf_counter() - start)
+            finally:
+                connection.close()
+                with lock:
+                    for kind, values in timings.items():
+                        results[kind].extend(values)
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        start = time.perf_counter()
+        deadline[0] = start + options['duration']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        settings_dict = connection.settings_dict
+        self.stdout.write(f"{settings_dict['ENGINE']} {settings_dict['NAME']}, "
+                          f"{len(users)} threads, write ratio {options['write_ratio']}")
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                pragmas = {}
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                    cursor.execute(f'PRAGMA {name}')
+                    pragmas[name] = cursor.fetchone()[0]
+            self.stdout.write(f"pragmas {pragmas}")
+        total = sum(len(values) for values in results.values())
+        self.stdout.write(f"{total / elapsed:.0f} ops/s, {len(errors)} errors")
+        for kind, values in results.items():
+            self.stdout.write(
+                f"  {kind:5} {len(values):6} ops  p50 {percentile(values, 0.5) * 1000:6.2f} ms  "
+                f"p99 {percentile(values, 0.99) * 1000:7.2f} ms"
+            )
+        for message in sorted(set(errors)):
+            self.stdout.write(f"  error: {message} x{errors.count(message)}")
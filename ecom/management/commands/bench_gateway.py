@@ -0,0 +1,82 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import razorpay
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from ecom import payments
+from ecom.fake_gateway import FakeGateway
+
+from ._stats import percentile
+
+
+def fresh_client_call(amount):
+    # what handle_payment used to do: a new client and connection for every order
+    client = razorpay.Client(auth=(settings.KEY_ID, settings.KEY_SECRET), base_url=settings.RAZORPAY_BASE_URL)
+    return client.order.create({'amount': amount, 'currency': 'INR', 'receipt': 'bench', 'payment_capture': '1'})
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = "Measure order creation throughput and latency against the fake gateway."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--latency', type=float, default=0.005, help="Simulated gateway latency in seconds.")
+        parser.add_argument('--base-url', help="Use an already running gateway instead of starting one.")
+
+    def handle(self, *args, **options):
+        server = None
+        base_url = options['base_url']
+        if not base_url:
+            server = FakeGateway(latency=options['latency']).start()
+            base_url = server.base_url
+        try:
+            with override_settings(RAZORPAY_BASE_URL=base_url, RAZORPAY_POOL_SIZE=options['concurrency']):
+                self.stdout.write(f"{'mode':<16} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+                self.run_threads('fresh client', fresh_client_call, options)
+                self.run_threads('pooled client', payments.create_order, options)
+                self.run_async(options)
+        finally:
+            if server:
+                server.stop()
+
+    def report(self, mode, timings, elapsed):
+        self.stdout.write(
+            f"{mode:<16} {len(timings) / elapsed:>8.0f} {percentile(timings, 0.5) * 1000:>8.2f} "
+            f"{percentile(timings, 0.99) * 1000:>8.2f}"
+        )
+
+    def run_threads(self, mode, func, options):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            timings = list(pool.map(lambda i: timed(func, 100 + i), range(options['requests'])))
+        self.report(mode, timings, time.perf_counter() - start)
+
+    def run_async(self, options):
+        async def bench():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def one(amount):
+                async with semaphore:
+                    start = time.perf_counter()
+                    await payments.acreate_order(amount)
+                    return time.perf_counter() - start
+
+            start = time.perf_counter()
+            timings = await asyncio.gather(*(one(100 + i) for i in range(options['requests'])))
+            elapsed = time.perf_counter() - start
+            await payments.close_async_session()
+            return list(timings), elapsed
+
+        timings, elapsed = asyncio.run(bench())
+        self.report('async client', timings, elapsed)
@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ecom.models import Coupon, Item, Order, OrderItem
+
+
+def legacy_total(order):
+    t = 0
+    for order_item in order.items.all():
+        t += order_item.get_final_price()
+    if order.coupon:
+        t -= order.coupon.amount
+    return t
+
+
+def measure(func, repeat):
+    # the first call warms up and counts queries, the timed calls run without capturing
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        result = func()
+    timings = []
+    for _ in range(repeat):
+        reset_queries()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return result, timings[len(timings) // 2] * 1000, len(queries)
+
+
+class Command(BaseCommand):
+    help = "Compare the Python loop and the SQL aggregate for Order.get_total (data is rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1, 50, 500])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'lines':>6} {'loop ms':>10} {'loop q':>7} {'sql ms':>10} {'sql q':>6}")
+        with transaction.atomic():
+            coupon = Coupon.objects.create(code='BENCHTOTAL', amount=5)
+            for size in options['sizes']:
+                # a user per size, each user may only have one open order
+                user = get_user_model().objects.create(username=f'bench_order_total_{size}')
+                self.report(user, coupon, size, options['repeat'])
+            transaction.set_rollback(True)
+
+    def report(self, user, coupon, size, repeat):
+        items = Item.objects.bulk_create([
+            Item(title=f'Bench item {i}', price=100 + i, discount_price=(90 + i) if i % 2 else None,
+                 category='S', label='P', slug=f'bench-{size}-{i}', description='bench', image='bench.jpg')
+            for i in range(size)
+        ])
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(user=user, item=item, quantity=i % 3 + 1) for i, item in enumerate(items)
+        ])
+        order = Order.objects.create(user=user, ordered_date=timezone.now(), coupon=coupon)
+        order.items.add(*order_items)
+
+        def loop():
+            return legacy_total(Order.objects.get(pk=order.pk))
+
+        def aggregate():
+            return Order.objects.get(pk=order.pk).get_total()
+
+        loop_total, loop_ms, loop_queries = measure(loop, repeat)
+        sql_total, sql_ms, sql_queries = measure(aggregate, repeat)
+        if abs(loop_total - sql_total) > 1e-6:
+            self.stderr.write(f"Totals differ for {size} lines: {loop_total} != {sql_total}")
+        self.stdout.write(f"{size:>6} {loop_ms:>10.2f} {loop_queries:>7} {sql_ms:>10.2f} {sql_queries:>6}")
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from ecom import routes
+
+CARD_ROUTES = [('ecom:ecom_detail', routes.item_detail_url)] * 2
+CART_ROUTES = [
+    ('ecom:decrease_quantity', routes.decrease_quantity_url),
+    ('ecom:increase_quantity', routes.increase_quantity_url),
+    ('ecom:remove_from_cart', routes.remove_from_cart_url),
+]
+
+
+def run(slugs, route_pairs, use_reverse):
+    for slug in slugs:
+        for name, builder in route_pairs:
+            if use_reverse:
+                reverse(name, kwargs={'slug': slug})
+            else:
+                builder(slug)
+
+
+class Command(BaseCommand):
+    help = "Compare reverse() with the memoized slug routes for a listing page and a cart page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        slugs = [f'bench-slug-{i}' for i in range(options['lines'])]
+        self.stdout.write(f"{'page':<22} {'reverse ms':>11} {'memo ms':>9}")
+        for label, pairs in (('listing (2 urls/card)', CARD_ROUTES), ('cart (3 urls/line)', CART_ROUTES)):
+            timings = {}
+            for use_reverse in (True, False):
+                run(slugs, pairs, use_reverse)
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    run(slugs, pairs, use_reverse)
+                timings[use_reverse] = (time.perf_counter() - start) * 1000 / options['repeat']
+            self.stdout.write(f"{label:<22} {timings[True]:>11.3f} {timings[False]:>9.3f}")
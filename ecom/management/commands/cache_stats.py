@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ecom.cache import reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters for the ecom caches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        for name in ('cart_count', 'listing', 'page', 'coupon'):
+            values = stats(name)
+            self.stdout.write(
+                f"{name}: {values['hits']} hits, {values['misses']} misses, "
+                f"hit rate {values['hit_rate']:.1%}"
+            )
+            if options['reset']:
+                reset_stats(name)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+
+from ecom.cart import CartService, load_cart
+from ecom.models import Item, Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = "Hammer one cart from several threads and check that no update was lost."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--clicks', type=int, default=50, help="Clicks per thread.")
+        parser.add_argument('--username', default='cart_load_test')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError("Threads need a file-backed database.")
+        user, _ = get_user_model().objects.get_or_create(username=options['username'])
+        item, _ = Item.objects.get_or_create(
+            slug='cart-load-test',
+            defaults={'title': 'Load test item', 'price': 10, 'category': 'S', 'label': 'P',
+                      'description': 'load test', 'image': 'load-test.jpg'}
+        )
+        Order.objects.filter(user=user).delete()
+        OrderItem.objects.filter(user=user).delete()
+
+        errors = []
+        barrier = threading.Barrier(options['threads'])
+
+        def retry(func, *args):
+            while True:
+                try:
+                    return func(*args)
+                except OperationalError:
+                    # SQLite gives up with "database is locked" when a read lock can't be upgraded
+                    time.sleep(0.001)
+
+        def worker():
+            service = CartService(user)
+            try:
+                barrier.wait()
+                retry(service.add, item)
+                for _ in range(options['clicks']):
+                    retry(service.increase, item.slug)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        order = load_cart(user)
+        lines = list(order.items.all())
+        expected = 1 + options['threads'] * options['clicks']
+        quantity = sum(line.quantity for line in lines)
+        self.stdout.write(
+            f"{options['threads']} threads x {options['clicks']} clicks in {elapsed:.2f}s: "
+            f"{Order.objects.filter(user=user, ordered=False).count()} open order(s), "
+            f"{len(lines)} line(s), quantity {quantity} (expected {expected}), "
+            f"total {order.get_total()}"
+        )
+        for error in errors:
+            self.stderr.write(repr(error))
+        if errors or len(lines) != 1 or quantity != expected:
+            raise CommandError("Cart ended up inconsistent.")
+        self.stdout.write(self.style.SUCCESS("No lost updates."))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from ecom.cart import CartService, cart_queryset
+from ecom.models import Address, Coupon, Item, Order, OrderItem
+
+# plan lines that mean a whole table (or index) is walked instead of searched
+SCAN_MARKERS = ('SCAN ', 'Seq Scan')
+
+# plans don't depend on the values, so any ids will do
+USER_ID = 1
+
+
+def view_queries():
+    return [
+        ('ecom:ecom_home', Item.objects.all()[:10], True),
+        ('ecom:ecom_detail', Item.objects.filter(slug='sample'), False),
+        ('cart_items_count', Order.objects.filter(user=USER_ID, ordered=False).annotate(lines=Count('items')), False),
+        ('ecom:ecom_cart', cart_queryset().filter(user=USER_ID, ordered=False), False),
+        ('ecom:ecom_cart lines', OrderItem.objects.filter(order__in=[1]).select_related('item'), False),
+        ('ecom:add_to_cart', OrderItem.objects.filter(item=1, user=USER_ID, ordered=False), False),
+        ('ecom:increase_quantity', CartService(USER_ID).lines('sample'), False),
+        ('ecom:ecom_checkout addresses',
+         Address.objects.filter(user=USER_ID, address_type__in=['S', 'B'], default=True), False),
+        ('ecom:add_coupon', Coupon.objects.filter(code='SAMPLE'), False),
+        ('ecom:request_refund', Order.objects.filter(ref_code='sample'), False),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Print the query plan for the lookups each view runs and flag table scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strict', action='store_true', help="Exit with an error when a lookup scans a table.")
+
+    def handle(self, *args, **options):
+        scans = []
+        for name, queryset, scan_ok in view_queries():
+            plan = queryset.explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for line in plan.splitlines():
+                flagged = not scan_ok and any(marker in line for marker in SCAN_MARKERS)
+                if flagged:
+                    scans.append(name)
+                    self.stdout.write(self.style.WARNING(f"  {line}"))
+                else:
+                    self.stdout.write(f"  {line}")
+        if scans:
+            message = f"Table scans in: {', '.join(sorted(set(scans)))}"
+            if options['strict']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every lookup is served by an index."))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ecom.fake_gateway import FakeGateway
+
+
+class Command(BaseCommand):
+    help = ("Run a local stand-in for the Razorpay orders API. POST /v1/orders/<id>/pay completes "
+            "checkout and returns the signed callback fields.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before answering.")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of requests answered with 502.")
+        parser.add_argument('--verbose', action='store_true')
+
+    def handle(self, *args, **options):
+        server = FakeGateway(options['host'], options['port'], options['latency'],
+                             options['failure_rate'], options['verbose'], key_secret=settings.KEY_SECRET,
+                             webhook_secret=settings.RAZORPAY_WEBHOOK_SECRET)
+        self.stdout.write(f"Fake gateway listening, set RAZORPAY_BASE_URL={server.base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
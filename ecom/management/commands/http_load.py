@@ -0,0 +1,70 @@
+import asyncio
+import itertools
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ._stats import percentile
+
+
+class Command(BaseCommand):
+    help = ("Load a running server with concurrent requests and report requests per second and latency "
+            "percentiles, e.g. to compare the WSGI and ASGI deployments.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Paths to request, used round robin.")
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--warmup', type=int, default=100)
+        parser.add_argument('--username', help="Log in first, needed for the cart pages.")
+        parser.add_argument('--password')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def login(self, session, base_url, username, password):
+        async with session.get(base_url + '/login') as response:
+            await response.read()
+        token = next((c.value for c in session.cookie_jar if c.key == 'csrftoken'), None)
+        data = {'username': username, 'password': password, 'csrfmiddlewaretoken': token}
+        async with session.post(base_url + '/login', data=data, allow_redirects=False) as response:
+            if response.status != 302:
+                raise CommandError(f"Login failed with status {response.status}")
+
+    async def load(self, session, urls, count, concurrency):
+        latencies = []
+        statuses = {}
+        remaining = itertools.islice(itertools.cycle(urls), count)
+
+        async def worker():
+            for url in remaining:
+                start = time.perf_counter()
+                async with session.get(url, allow_redirects=False) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies, statuses
+
+    async def run(self, options):
+        import aiohttp
+
+        base_url = options['base_url'].rstrip('/')
+        urls = [base_url + '/' + path.lstrip('/') for path in options['paths']]
+        connector = aiohttp.TCPConnector(limit=options['concurrency'])
+        # the default jar drops cookies set by IP addresses like 127.0.0.1
+        jar = aiohttp.CookieJar(unsafe=True)
+        async with aiohttp.ClientSession(connector=connector, cookie_jar=jar) as session:
+            if options['username']:
+                await self.login(session, base_url, options['username'], options['password'])
+            await self.load(session, urls, options['warmup'], options['concurrency'])
+            elapsed, latencies, statuses = await self.load(session, urls, options['requests'],
+                                                           options['concurrency'])
+        self.stdout.write(
+            f"{len(latencies)} requests in {elapsed:.2f}s, {len(latencies) / elapsed:.0f} req/s, "
+            f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+            f"statuses {dict(sorted(statuses.items()))}"
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from ecom.models import Item
+from ecom.thumbnails import delete_thumbnails, needs_thumbnails, update_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Make the resized copies of item images that don't have them yet, e.g. after a deploy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Remake every item's thumbnails.")
+
+    def handle(self, *args, **options):
+        made = failed = 0
+        for item in Item.objects.exclude(image='').only('pk', 'image', 'thumbnails').iterator():
+            if options['force'] and item.thumbnails:
+                delete_thumbnails(item.thumbnails)
+                item.thumbnails = {}
+            if not needs_thumbnails(item):
+                continue
+            try:
+                update_thumbnails(item)
+            except OSError as e:
+                failed += 1
+                self.stderr.write(f"{item.image.name}: {e}")
+                continue
+            made += 1
+        self.stdout.write(f"Made thumbnails for {made} items, {failed} failed.")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ecom.search import rebuild_index, search_enabled
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for all items."
+
+    def handle(self, *args, **options):
+        if not search_enabled():
+            self.stdout.write("Full-text index is only used on SQLite, nothing to rebuild.")
+            return
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} items."))
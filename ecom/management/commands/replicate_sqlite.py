@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ecom.db import replicate_sqlite
+
+
+class Command(BaseCommand):
+    help = ("Copy the primary SQLite database onto the replica file, a local stand-in for replication. "
+            "With --interval it keeps copying, which simulates replication lag.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help="Seconds between copies, 0 copies once.")
+
+    def handle(self, *args, **options):
+        replica = settings.DB_REPLICA_ALIAS
+        if replica is None or settings.DB_PROFILE != 'sqlite':
+            raise CommandError("Set DB_REPLICA_NAME with the sqlite profile to use the replication stand-in.")
+        try:
+            while True:
+                start = time.perf_counter()
+                replicate_sqlite('default', replica)
+                self.stdout.write(f"copied to {settings.DATABASES[replica]['NAME']} in "
+                                  f"{(time.perf_counter() - start) * 1000:.1f} ms")
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,80 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from ecom.jobs import run_jobs
+from ecom.orders import process_payment_events
+
+
+class Stop:
+    # set from signal handlers, so a plain attribute: anything that takes a lock could deadlock
+    requested = False
+
+    def request(self, *args):
+        self.requested = True
+
+    def on(self, *signums):
+        for signum in signums:
+            signal.signal(signum, self.request)
+        return self
+
+
+def work(batch, interval, once, stop=None):
+    # One worker process: finishes the job at hand when told to stop, a claim cut short would
+    # wait out the visibility timeout. Payment events go first, they hold up a customer's order.
+    if stop is None:
+        # a pool child, the parent passes Ctrl-C on as SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop = Stop().on(signal.SIGTERM)
+    processed = 0
+    while not stop.requested:
+        close_old_connections()
+        count = process_payment_events() + run_jobs(batch, stopping=lambda: stop.requested)
+        processed += count
+        if not count:
+            if once:
+                break
+            time.sleep(interval)
+    connections.close_all()
+    return processed
+
+
+class Command(BaseCommand):
+    help = ("Run queued jobs, such as item thumbnails and recording sales, and finalize paid orders "
+            "in a pool of worker processes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Worker processes, JOB_WORKER_PROCESSES by default.")
+        parser.add_argument('--batch', type=int, default=None, help="Jobs claimed per round.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep while the queues are empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queues and exit.")
+
+    def handle(self, *args, **options):
+        processes = options['processes'] or settings.JOB_WORKER_PROCESSES
+        work_args = (options['batch'], options['interval'], options['once'])
+        stop = Stop().on(signal.SIGINT, signal.SIGTERM)
+        if processes == 1:
+            # in this process, which keeps tests and debuggers simple
+            processed = work(*work_args, stop=stop)
+            self.stdout.write(f"{processed} jobs processed")
+            return
+        # the children mustn't share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=work, args=work_args, daemon=True) for _ in range(processes)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        stopping = False
+        while any(worker.is_alive() for worker in workers):
+            if stop.requested and not stopping:
+                stopping = True
+                for worker in workers:
+                    worker.terminate()
+            time.sleep(0.2)
+        self.stdout.write(f"{processes} workers stopped after {time.monotonic() - started:.1f}s")
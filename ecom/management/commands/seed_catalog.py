@@ -0,0 +1,130 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ecom import search
+from ecom.cache import bump_catalog_version
+from ecom.models import CATEGORY_CHOICES, LABEL_CHOICES, Address, Coupon, Item, Order, OrderItem
+from ecom.orders import create_ref_code
+
+ADJECTIVES = ['Classic', 'Slim', 'Relaxed', 'Vintage', 'Striped', 'Linen', 'Denim', 'Cotton', 'Merino', 'Checked']
+NOUNS = ['Shirt', 'Polo', 'Hoodie', 'Jacket', 'Tracksuit', 'Parka', 'Tee', 'Windbreaker', 'Cardigan', 'Overshirt']
+COLOURS = ['black', 'white', 'navy', 'olive', 'grey', 'red', 'sand', 'teal']
+
+
+def coupon_prefix(prefix):
+    # codes are at most 15 characters, six of them are the number
+    return prefix.upper()[:9]
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with synthetic items, users, addresses, coupons, open carts and past orders, "
+            "for benchmarks and load tests.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--carts', type=int, default=None, help="Users with an open cart, half of them by default.")
+        parser.add_argument('--orders', type=int, default=None, help="Past orders, two per user by default.")
+        parser.add_argument('--lines', type=int, default=5, help="Lines per cart and order.")
+        parser.add_argument('--coupons', type=int, default=20)
+        parser.add_argument('--prefix', default='seed', help="Starts every slug, username and coupon code.")
+        parser.add_argument('--password', default='seed-pass', help="Password of every seeded user.")
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--flush', action='store_true', help="Delete earlier data with the same prefix first.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['random_seed'])
+        prefix = options['prefix']
+        users = options['users']
+        carts = min(users, users // 2 if options['carts'] is None else options['carts'])
+        orders = users * 2 if options['orders'] is None else options['orders']
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            if options['flush']:
+                self.flush(prefix)
+            items = self.create_items(rng, prefix, options['items'])
+            users = self.create_users(prefix, users, options['password'])
+            self.create_addresses(rng, users)
+            coupons = self.create_coupons(rng, prefix, options['coupons'])
+            lines = min(options['lines'], len(items))
+            self.create_orders(rng, users[:carts], items, coupons, lines, ordered=False)
+            self.create_orders(rng, [rng.choice(users) for _ in range(orders)], items, coupons, lines, ordered=True)
+        # bulk_create skips the Item signals, so the search index and cached pages are brought up to date here
+        search.rebuild_index()
+        bump_catalog_version()
+        self.stdout.write(
+            f"Seeded {len(items)} items, {len(users)} users with addresses, {len(coupons)} coupons, "
+            f"{carts} open carts and {orders} orders of {lines} lines."
+        )
+
+    def flush(self, prefix):
+        User = get_user_model()
+        User.objects.filter(username__startswith=f'{prefix}-').delete()
+        Item.objects.filter(slug__startswith=f'{prefix}-').delete()
+        Coupon.objects.filter(code__startswith=coupon_prefix(prefix)).delete()
+
+    def create_items(self, rng, prefix, count):
+        categories = [code for code, _ in CATEGORY_CHOICES]
+        labels = [code for code, _ in LABEL_CHOICES]
+        items = []
+        for i in range(count):
+            title = f'{rng.choice(ADJECTIVES)} {rng.choice(COLOURS)} {rng.choice(NOUNS).lower()}'
+            price = rng.randrange(299, 4999)
+            items.append(Item(
+                title=title, slug=f'{prefix}-item-{i}', price=price,
+                discount_price=round(price * rng.uniform(0.6, 0.9)) if rng.random() < 0.4 else None,
+                category=rng.choice(categories), label=rng.choice(labels),
+                description=f'{title}, {rng.choice(COLOURS)} trim, regular fit. Seeded item {i}.',
+                image=f'{prefix}.jpg'
+            ))
+        return Item.objects.bulk_create(items, batch_size=self.batch_size)
+
+    def create_users(self, prefix, count, password):
+        User = get_user_model()
+        # one hash for all of them, hashing is deliberately slow
+        password = make_password(password)
+        return User.objects.bulk_create([
+            User(username=f'{prefix}-user-{i}', email=f'{prefix}-user-{i}@example.com', password=password)
+            for i in range(count)
+        ], batch_size=self.batch_size)
+
+    def create_addresses(self, rng, users):
+        Address.objects.bulk_create([
+            Address(user=user, address_line1=f'{rng.randrange(1, 500)} Market Road',
+                    address_line2=f'Block {rng.choice("ABCDEF")}', country='IN', zip=f'{rng.randrange(110001, 855999)}',
+                    address_type=address_type, default=True)
+            for user in users for address_type in ('B', 'S')
+        ], batch_size=self.batch_size)
+
+    def create_coupons(self, rng, prefix, count):
+        return Coupon.objects.bulk_create([
+            Coupon(code=f'{coupon_prefix(prefix)}{i:06d}', amount=rng.choice([50, 100, 200, 500]))
+            for i in range(count)
+        ], batch_size=self.batch_size)
+
+    def create_orders(self, rng, users, items, coupons, lines, ordered):
+        now = timezone.now()
+        orders = Order.objects.bulk_create([
+            Order(user=user, ordered=ordered, ordered_date=now, paid=ordered,
+                  ref_code=create_ref_code() if ordered else None,
+                  coupon=rng.choice(coupons) if coupons and rng.random() < 0.2 else None)
+            for user in users
+        ], batch_size=self.batch_size)
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(user=order.user, item=item, quantity=rng.randint(1, 3), ordered=ordered)
+            for order in orders for item in rng.sample(items, lines)
+        ], batch_size=self.batch_size)
+        Through = Order.items.through
+        Through.objects.bulk_create([
+            Through(order_id=order.pk, orderitem_id=order_item.pk)
+            for index, order in enumerate(orders)
+            for order_item in order_items[index * lines:(index + 1) * lines]
+        ], batch_size=self.batch_size)
+        for start in range(0, len(orders), self.batch_size):
+            Order.objects.filter(pk__in=[order.pk for order in orders[start:start + self.batch_size]]).update_totals()
@@ -0,0 +1,182 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .cache import incr_counter, make_key
+
+# Prometheus' default buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+HISTOGRAMS = {
+    'ecom_request_duration_seconds': ("Wall time of sampled requests.", DURATION_BUCKETS),
+    'ecom_db_duration_seconds': ("Time sampled requests spent in database queries.", DURATION_BUCKETS),
+    'ecom_db_queries': ("Database queries run by sampled requests.", QUERY_BUCKETS),
+    'ecom_template_duration_seconds': ("Time sampled requests spent rendering templates.", DURATION_BUCKETS),
+    'ecom_gateway_duration_seconds': ("Time sampled requests spent waiting on the payment gateway.",
+                                      DURATION_BUCKETS),
+}
+# sums are kept as integers in the shared cache, so incr() can add to them
+SUM_SCALE = 10 ** 6
+SERIES_KEY = make_key('metrics', 'series')
+
+_current = ContextVar('ecom_metrics', default=None)
+_lock = threading.Lock()
+# (metric, view) -> [count per bucket and +Inf, scaled sum], this process' share since its last flush
+_pending = {}
+_last_flush = [time.monotonic()]
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = self.template = self.gateway = 0.0
+        self.queries = 0
+        self.rendering = False
+
+    def server_timing(self, total):
+        return (f'app;dur={total * 1000:.1f}, db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+                f'tpl;dur={self.template * 1000:.1f}, gateway;dur={self.gateway * 1000:.1f}')
+
+
+def sampled():
+    rate = settings.METRICS_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def start():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timer(name):
+    # adds the block's time to the sampled request's total for name, if there is one
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, name, getattr(timings, name) + time.perf_counter() - started)
+
+
+@contextmanager
+def template_timer():
+    # included templates and nested render_to_string calls are part of the outer render
+    timings = _current.get()
+    if timings is None or timings.rendering:
+        yield
+        return
+    timings.rendering = True
+    try:
+        with timer('template'):
+            yield
+    finally:
+        timings.rendering = False
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # the same wrapper object is reused when a persistent connection reconnects
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def observe(metric, view, value):
+    buckets = HISTOGRAMS[metric][1]
+    with _lock:
+        counts = _pending.setdefault((metric, view), [0] * (len(buckets) + 2))
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += round(value * SUM_SCALE)
+
+
+def finish(request, response, timings):
+    total = time.perf_counter() - timings.start
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'unmatched'
+    observe('ecom_request_duration_seconds', view, total)
+    observe('ecom_db_duration_seconds', view, timings.db)
+    observe('ecom_db_queries', view, timings.queries)
+    observe('ecom_template_duration_seconds', view, timings.template)
+    observe('ecom_gateway_duration_seconds', view, timings.gateway)
+    if settings.METRICS_SERVER_TIMING:
+        response['Server-Timing'] = timings.server_timing(total)
+    if time.monotonic() - _last_flush[0] >= settings.METRICS_FLUSH_INTERVAL:
+        flush()
+    return response
+
+
+def value_key(metric, view, index):
+    return make_key('metrics', metric, view, index)
+
+
+def flush():
+    # adds this process' observations to the totals in the shared cache, which every worker sees
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = time.monotonic()
+    if not pending:
+        return
+    series = cache.get(SERIES_KEY) or set()
+    if not series.issuperset(pending):
+        cache.set(SERIES_KEY, series | set(pending), None)
+    for (metric, view), counts in pending.items():
+        for index, count in enumerate(counts):
+            if count:
+                incr_counter(value_key(metric, view, index), count, None)
+
+
+def export():
+    """
+    Every series in the Prometheus text format. The histograms hold sampled requests only,
+    ecom_metrics_sample_rate says what share of the traffic that is.
+    """
+    flush()
+    series = sorted(cache.get(SERIES_KEY) or ())
+    lines = [
+        '# HELP ecom_metrics_sample_rate Share of requests that are measured.',
+        '# TYPE ecom_metrics_sample_rate gauge',
+        f'ecom_metrics_sample_rate {settings.METRICS_SAMPLE_RATE}',
+    ]
+    for metric, (description, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} histogram')
+        for view in (view for name, view in series if name == metric):
+            keys = [value_key(metric, view, index) for index in range(len(buckets) + 2)]
+            values = cache.get_many(keys)
+            counts = [values.get(key, 0) for key in keys]
+            label = view.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{view="{label}"}} {counts[-1] / SUM_SCALE}')
+            lines.append(f'{metric}_count{{view="{label}"}} {cumulative}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,126 @@
+import asyncio
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics, querywatch, routers
+from .guest_cart import get_guest_cart
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    # whitenoise 6.0 is sync only, and under ASGI that makes Django run everything below
+    # it through async_to_sync, a fresh event loop in a thread for every request
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    # A visitor who changed something reads from the primary for DB_REPLICA_PIN_SECONDS,
+    # so their next page never shows the replica's older copy.
+    cookie_name = 'ecom_primary'
+
+    def process_request(self, request):
+        routers.start_request(pinned=self.cookie_name in request.COOKIES)
+
+    def process_response(self, request, response):
+        if routers.wrote() and routers.replica_alias():
+            response.set_cookie(self.cookie_name, '1', max_age=settings.DB_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class GuestCartMiddleware(MiddlewareMixin):
+    # writes back the signed cart cookie of an anonymous visitor whose cart changed
+    def process_response(self, request, response):
+        if hasattr(request, '_guest_cart'):
+            get_guest_cart(request).save(response)
+        return response
+
+
+class RequestMetricsMiddleware:
+    # Times a METRICS_SAMPLE_RATE share of requests: wall time, queries, template rendering and
+    # the payment gateway, per URL name. First in MIDDLEWARE so the wall time covers the rest.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not metrics.sampled():
+            return self.get_response(request)
+        timings, token = metrics.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop(token)
+        return metrics.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not metrics.sampled():
+            return await self.get_response(request)
+        timings, token = metrics.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop(token)
+        return metrics.finish(request, response, timings)
+
+
+class QueryWatchMiddleware:
+    # Development and staging only, with QUERY_WATCH on: logs the query shapes a request repeats and
+    # its slow queries with the code that ran them, and adds them to the view's report.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_WATCH:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with querywatch.watch_queries() as watch:
+            response = self.get_response(request)
+        return self.finish(request, response, watch)
+
+    async def __acall__(self, request):
+        with querywatch.watch_queries() as watch:
+            response = await self.get_response(request)
+        return self.finish(request, response, watch)
+
+    def finish(self, request, response, watch):
+        report = watch.report()
+        if report['repeated'] or report['slow']:
+            match = getattr(request, 'resolver_match', None)
+            view = match.view_name if match else 'unmatched'
+            querywatch.log_findings(view, request.path, report)
+            querywatch.write_report(view, request.path, report)
+        response['X-Query-Watch'] = (f"{report['queries']} queries, {len(report['repeated'])} repeated, "
+                                     f"{len(report['slow'])} slow")
+        return response
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ecom_item_search USING fts5("
+        "title, description, category, tokenize='unicode61', prefix='2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO ecom_item_search (rowid, title, description, category) "
+        "SELECT id, title, description, CASE category "
+        "WHEN 'S' THEN 'Shirt' WHEN 'SW' THEN 'Sport wear' WHEN 'OW' THEN 'Outwear' ELSE category END "
+        "FROM ecom_item"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS ecom_item_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0002_delete_billingaddress'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.4 on 2026-10-18 16:59
+
+from django.db import migrations, models
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model('ecom', 'Order')
+    OrderItem = apps.get_model('ecom', 'OrderItem')
+    Coupon = apps.get_model('ecom', 'Coupon')
+    line_total = F('quantity') * Case(
+        When(Q(item__discount_price__isnull=True) | Q(item__discount_price=0), then=F('item__price')),
+        default=F('item__discount_price'),
+        output_field=FloatField()
+    )
+    items_total = OrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(
+        total=Sum(line_total, output_field=FloatField())
+    ).values('total')
+    coupon_amount = Coupon.objects.filter(pk=OuterRef('coupon_id')).values('amount')
+    Order.objects.update(
+        total=Coalesce(Subquery(items_total), Value(0.0)) - Coalesce(Subquery(coupon_amount), Value(0.0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0003_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
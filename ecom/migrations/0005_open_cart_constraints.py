@@ -0,0 +1,53 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:01
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_open_carts(apps, schema_editor):
+    Order = apps.get_model('ecom', 'Order')
+    OrderItem = apps.get_model('ecom', 'OrderItem')
+    Through = Order.items.through
+
+    duplicated_users = Order.objects.filter(ordered=False).values('user').annotate(
+        orders=Count('pk')).filter(orders__gt=1).values_list('user', flat=True)
+    for user_id in list(duplicated_users):
+        keep, *extra = Order.objects.filter(user_id=user_id, ordered=False).order_by('pk')
+        kept_lines = set(Through.objects.filter(order=keep).values_list('orderitem_id', flat=True))
+        for order in extra:
+            for line_id in Through.objects.filter(order=order).values_list('orderitem_id', flat=True):
+                if line_id not in kept_lines:
+                    Through.objects.create(order=keep, orderitem_id=line_id)
+                    kept_lines.add(line_id)
+            order.delete()
+
+    duplicated_lines = OrderItem.objects.filter(ordered=False).values('user', 'item').annotate(
+        lines=Count('pk'), quantity=Sum('quantity')).filter(lines__gt=1)
+    for row in list(duplicated_lines):
+        keep, *extra = OrderItem.objects.filter(user_id=row['user'], item_id=row['item'], ordered=False).order_by('pk')
+        extra_ids = [line.pk for line in extra]
+        for order_id in Through.objects.filter(orderitem_id__in=extra_ids).values_list('order_id', flat=True):
+            if not Through.objects.filter(order_id=order_id, orderitem=keep).exists():
+                Through.objects.create(order_id=order_id, orderitem=keep)
+        OrderItem.objects.filter(pk__in=extra_ids).delete()
+        keep.quantity = row['quantity']
+        keep.save(update_fields=['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0004_order_total'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_open_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user',), name='unique_open_order'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user', 'item'), name='unique_open_order_item'),
+        ),
+    ]
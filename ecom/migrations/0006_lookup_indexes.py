@@ -0,0 +1,56 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:04
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe(model, field, max_length):
+    duplicated = model.objects.values(field).annotate(rows=Count('pk')).filter(rows__gt=1)
+    for value in list(duplicated.values_list(field, flat=True)):
+        # the oldest row keeps its value, later ones get their pk appended
+        for obj in model.objects.filter(**{field: value}).order_by('pk')[1:]:
+            suffix = f'-{obj.pk}'
+            setattr(obj, field, value[:max_length - len(suffix)] + suffix)
+            obj.save(update_fields=[field])
+
+
+def dedupe_slugs_and_codes(apps, schema_editor):
+    dedupe(apps.get_model('ecom', 'Item'), 'slug', 50)
+    dedupe(apps.get_model('ecom', 'Coupon'), 'code', 15)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0005_open_cart_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slugs_and_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['user', 'address_type', 'default'], name='address_user_type_default_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'ordered'], name='order_user_ordered_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ref_code'], name='order_ref_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['item', 'user', 'ordered'], name='orderitem_item_user_idx'),
+        ),
+    ]
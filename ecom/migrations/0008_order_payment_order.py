@@ -0,0 +1,23 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0007_item_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_order_id',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0008_order_payment_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=40, unique=True)),
+                ('gateway_order_id', models.CharField(max_length=40)),
+                ('source', models.CharField(choices=[('C', 'Checkout callback'), ('W', 'Webhook')], max_length=1)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('R', 'Processing'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ecom.order')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(fields=['status', 'id'], name='paymentevent_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecom', '0011_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='payment_order_id',
+            field=models.CharField(blank=True, max_length=40, null=True, unique=True),
+        ),
+    ]
@@ -1,8 +1,11 @@
 from django.db import models
-from django.shortcuts import reverse
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django_countries.fields import CountryField
 
+from . import routes
+
 # Create your models here.
 ADDRESS_CHOICES = (
     ('B', 'Billing'),
@@ -33,33 +36,54 @@ class Item(models.Model):
     discount_price = models.FloatField(blank=True, null=True)
     category = models.CharField(choices=CATEGORY_CHOICES, max_length=2)
     label = models.CharField(choices=LABEL_CHOICES, max_length=1)
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
     description = models.TextField()
     image = models.ImageField()
+    # {'source': image name, format: [widths]} for the resized copies in ecom.thumbnails
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+    units_sold = models.PositiveIntegerField(default=0)
     objects = models.Manager()
 
     def __str__(self):
         return self.title
 
     def get_absolute_url(self):
-        return reverse("ecom:ecom_detail", kwargs={
-            'slug': self.slug
-        })
+        return routes.item_detail_url(self.slug)
 
     def get_add_to_cart_url(self):
-        return reverse("ecom:add_to_cart", kwargs={
-            'slug': self.slug
-        })
+        return routes.add_to_cart_url(self.slug)
 
     def get_remove_from_cart_url(self):
-        return reverse("ecom:remove_from_cart", kwargs={
-            'slug': self.slug
-        })
+        return routes.remove_from_cart_url(self.slug)
 
     def get_buy_now_url(self):
-        return reverse("ecom:buy_now", kwargs={
-            'slug': self.slug
-        })
+        return routes.buy_now_url(self.slug)
+
+    def get_increase_quantity_url(self):
+        return routes.increase_quantity_url(self.slug)
+
+    def get_decrease_quantity_url(self):
+        return routes.decrease_quantity_url(self.slug)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='item_price_id_idx'),
+            models.Index(fields=['title', 'id'], name='item_title_id_idx')
+        ]
+
+
+def line_total_expression():
+    no_discount = Q(item__discount_price__isnull=True) | Q(item__discount_price=0)
+    return F('quantity') * Case(
+        When(no_discount, then=F('item__price')),
+        default=F('item__discount_price'),
+        output_field=FloatField()
+    )
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def with_line_total(self):
+        return self.annotate(line_total=line_total_expression())
 
 
 class OrderItem(models.Model):
@@ -68,7 +92,7 @@ class OrderItem(models.Model):
     ordered = models.BooleanField(default=False)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
-    objects = models.Manager()
+    objects = OrderItemQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
@@ -83,10 +107,46 @@ class OrderItem(models.Model):
         return self.get_total_item_price() - self.get_total_discount_item_price()
 
     def get_final_price(self):
+        if hasattr(self, 'line_total'):
+            return self.line_total
         if self.item.discount_price:
             return self.get_total_discount_item_price()
         return self.get_total_item_price()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item'], condition=models.Q(ordered=False),
+                                    name='unique_open_order_item')
+        ]
+        indexes = [
+            models.Index(fields=['item', 'user', 'ordered'], name='orderitem_item_user_idx')
+        ]
+
+
+def items_total_subquery():
+    return OrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(
+        total=Sum(line_total_expression(), output_field=FloatField())
+    ).values('total')
+
+
+def coupon_amount_subquery():
+    return Coupon.objects.filter(pk=OuterRef('coupon_id')).values('amount')
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_total(self):
+        # one expression, an annotation referenced by another is inlined and runs the subquery again
+        return self.annotate(
+            computed_total=Coalesce(Subquery(items_total_subquery()), Value(0.0))
+            - Coalesce(F('coupon__amount'), Value(0.0))
+        )
+
+    def update_totals(self):
+        return self.update(
+            total=Coalesce(Subquery(items_total_subquery()), Value(0.0))
+            - Coalesce(Subquery(coupon_amount_subquery()), Value(0.0))
+        )
+
 
 class Order(models.Model):
     items = models.ManyToManyField(OrderItem)
@@ -94,7 +154,6 @@ class Order(models.Model):
     ordered = models.BooleanField(default=False)
     start_date = models.DateTimeField(auto_now_add=True)
     ordered_date = models.DateTimeField()
-    objects = models.Manager()
     billing_address = models.ForeignKey('Address', related_name='billing_address', on_delete=models.SET_NULL,
                                         blank=True, null=True)
     shipping_address = models.ForeignKey('Address', related_name='shipping_address', on_delete=models.SET_NULL,
@@ -106,21 +165,43 @@ class Order(models.Model):
     refund_requested = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
     ref_code = models.CharField(max_length=20, blank=True, null=True)
+    total = models.FloatField(default=0)
+    payment_order_id = models.CharField(max_length=40, blank=True, null=True, unique=True)
+    payment_key = models.CharField(max_length=64, blank=True, null=True)
+    objects = OrderQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username
 
     def get_total(self):
-        t = 0
-        for order_item in self.items.all():
-            t += order_item.get_final_price()
-        if self.coupon:
-            t -= self.coupon.amount
-        return t
+        if settings.ECOM_USE_STORED_ORDER_TOTAL:
+            return self.total
+        if not hasattr(self, 'computed_total'):
+            self.computed_total = Order.objects.filter(pk=self.pk).with_total().values_list(
+                'computed_total', flat=True
+            ).get()
+        return self.computed_total
+
+    def update_total(self):
+        Order.objects.filter(pk=self.pk).update_totals()
+        self.refresh_from_db(fields=['total'])
+        if hasattr(self, 'computed_total'):
+            del self.computed_total
+        return self.total
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(ordered=False),
+                                    name='unique_open_order')
+        ]
+        indexes = [
+            models.Index(fields=['user', 'ordered'], name='order_user_ordered_idx'),
+            models.Index(fields=['ref_code'], name='order_ref_code_idx')
+        ]
 
 
 class Coupon(models.Model):
-    code = models.CharField(max_length=15)
+    code = models.CharField(max_length=15, unique=True)
     amount = models.FloatField(default=0)
     objects = models.Manager()
 
@@ -128,6 +209,78 @@ class Coupon(models.Model):
         return self.code
 
 
+class PaymentEvent(models.Model):
+    PENDING = 'P'
+    PROCESSING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    CALLBACK = 'C'
+    WEBHOOK = 'W'
+    SOURCE_CHOICES = (
+        (CALLBACK, 'Checkout callback'),
+        (WEBHOOK, 'Webhook'),
+    )
+
+    order = models.ForeignKey('Order', on_delete=models.CASCADE)
+    payment_id = models.CharField(max_length=40, unique=True)
+    gateway_order_id = models.CharField(max_length=40)
+    source = models.CharField(max_length=1, choices=SOURCE_CHOICES)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    objects = models.Manager()
+
+    def __str__(self):
+        return self.payment_id
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='paymentevent_status_idx')
+        ]
+
+
+class Job(models.Model):
+    PENDING = 'P'
+    PROCESSING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    # dotted path of a function decorated with ecom.jobs.job
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'{self.task}{tuple(self.args)}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx')
+        ]
+
+
 class Refund(models.Model):
     order = models.ForeignKey('Order', on_delete=models.CASCADE)
     reason = models.TextField()
@@ -154,3 +307,6 @@ class Address(models.Model):
 
     class Meta:
         verbose_name_plural = 'Addresses'
+        indexes = [
+            models.Index(fields=['user', 'address_type', 'default'], name='address_user_type_default_idx')
+        ]
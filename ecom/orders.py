@@ -0,0 +1,154 @@
+import hashlib
+import random
+import string
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .cache import invalidate_cart_count_for
+from .jobs import task
+from .models import Item, Order, OrderItem, PaymentEvent
+from .payments import create_order
+
+PAYMENT_CURRENCY = 'INR'
+
+
+def create_ref_code():
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
+
+
+def finalize_order(order, paid=False):
+    # Only this order's lines are touched, so the cost doesn't depend on the size of
+    # the OrderItem table. Returns False when the order had already been finalized.
+    ref_code = create_ref_code()
+    with transaction.atomic():
+        orders = Order.objects.filter(pk=order.pk, ordered=False)
+        orders.update_totals()
+        fields = {'ordered': True, 'ref_code': ref_code}
+        if paid:
+            fields['paid'] = True
+        if not orders.update(**fields):
+            return False
+        OrderItem.objects.filter(order=order, ordered=False).update(ordered=True)
+        # queued in the same transaction, so a finalized order always gets its sale recorded
+        record_order_sale.delay(order.pk)
+    order.refresh_from_db(fields=['ordered', 'paid', 'ref_code', 'total'])
+    invalidate_cart_count_for(order.user_id)
+    return True
+
+
+@task(atomic=True)
+def record_order_sale(order_id):
+    record_sale(Order(pk=order_id))
+
+
+def record_sale(order):
+    # one UPDATE, an open order holds at most one line per item
+    quantity = OrderItem.objects.filter(order=order, item=OuterRef('pk')).values('quantity')[:1]
+    Item.objects.filter(orderitem__order=order).update(units_sold=F('units_sold') + Subquery(quantity))
+
+
+def payment_snapshot(order):
+    # amount in paise plus a key that changes whenever anything billable in the cart does
+    lines = list(OrderItem.objects.filter(order=order).with_line_total().order_by('item_id').values_list(
+        'item_id', 'quantity', 'line_total'
+    ))
+    coupon_amount = order.coupon.amount if order.coupon_id else 0
+    amount = int(round((sum(line_total for _, _, line_total in lines) - coupon_amount) * 100))
+    fingerprint = repr((order.pk, lines, order.coupon_id, coupon_amount, amount, PAYMENT_CURRENCY))
+    return amount, hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def stored_payment_order(order, snapshot=None):
+    # the gateway order stored on the cart, None when there is none or the cart changed since
+    amount, key = snapshot or payment_snapshot(order)
+    if order.payment_order_id and order.payment_key == key:
+        return {'id': order.payment_order_id, 'amount': amount, 'currency': PAYMENT_CURRENCY}
+    return None
+
+
+def get_payment_order(order):
+    # Reuses the gateway order stored on the cart while its contents are unchanged, so
+    # repeat posts don't create new gateway orders.
+    snapshot = payment_snapshot(order)
+    stored = stored_payment_order(order, snapshot)
+    if stored is not None:
+        return stored
+    amount, key = snapshot
+    payment = create_order(amount, currency=PAYMENT_CURRENCY, receipt=f'order-{order.pk}',
+                           notes={'cart_key': key})
+    # another request may have stored an order for the same cart while we waited on the gateway
+    if not Order.objects.filter(pk=order.pk).exclude(payment_key=key).update(
+        payment_order_id=payment['id'], payment_key=key
+    ):
+        order.refresh_from_db(fields=['payment_order_id', 'payment_key'])
+        return stored_payment_order(order, snapshot)
+    order.payment_order_id = payment['id']
+    order.payment_key = key
+    return payment
+
+
+def enqueue_payment(order, payment_id, gateway_order_id, source):
+    # the callback and the webhook report the same payment, whichever lands second is a no-op
+    event, created = PaymentEvent.objects.get_or_create(payment_id=payment_id, defaults={
+        'order': order, 'gateway_order_id': gateway_order_id, 'source': source
+    })
+    return created
+
+
+def claimable_events():
+    stale = timezone.now() - timedelta(seconds=settings.PAYMENT_QUEUE_CLAIM_TIMEOUT)
+    return PaymentEvent.objects.filter(
+        Q(status=PaymentEvent.PENDING) | Q(status=PaymentEvent.PROCESSING, claimed_at__lt=stale)
+    )
+
+
+def claim_payment_events(limit):
+    # a claim is a conditional UPDATE, so several workers can drain the queue at once;
+    # events held by a worker that died become claimable again after the claim timeout
+    claimed = []
+    for pk in claimable_events().order_by('pk').values_list('pk', flat=True)[:limit]:
+        if claimable_events().filter(pk=pk).update(status=PaymentEvent.PROCESSING, claimed_at=timezone.now(),
+                                                   attempts=F('attempts') + 1):
+            claimed.append(pk)
+    return list(PaymentEvent.objects.filter(pk__in=claimed).select_related('order').order_by('pk'))
+
+
+def unpaid_changes(event, order):
+    # why the paid gateway order doesn't cover the cart as it is now, None when it does
+    if event.gateway_order_id != order.payment_order_id:
+        return f"Paid gateway order {event.gateway_order_id} isn't the cart's {order.payment_order_id}"
+    if payment_snapshot(order)[1] != order.payment_key:
+        return "The cart changed after it was paid for"
+    return None
+
+
+def process_payment_event(event):
+    # True when this event finalized the order, False for a duplicate or a failure
+    try:
+        with transaction.atomic():
+            # locked, so a cart change waits until the order is finalized
+            order = Order.objects.select_for_update().select_related('coupon').get(pk=event.order_id)
+            reason = None if order.ordered else unpaid_changes(event, order)
+            finalized = reason is None and finalize_order(order, paid=True)
+    except Exception as e:
+        status = PaymentEvent.FAILED if event.attempts >= settings.PAYMENT_QUEUE_MAX_ATTEMPTS else PaymentEvent.PENDING
+        PaymentEvent.objects.filter(pk=event.pk).update(status=status, error=repr(e))
+        return False
+    if reason is not None:
+        PaymentEvent.objects.filter(pk=event.pk).update(status=PaymentEvent.FAILED, error=reason,
+                                                        processed_at=timezone.now())
+        return False
+    PaymentEvent.objects.filter(pk=event.pk).update(status=PaymentEvent.DONE, error='',
+                                                    processed_at=timezone.now())
+    return finalized
+
+
+def process_payment_events(limit=None):
+    events = claim_payment_events(limit or settings.PAYMENT_QUEUE_BATCH)
+    for event in events:
+        process_payment_event(event)
+    return len(events)
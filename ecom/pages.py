@@ -0,0 +1,116 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .cache import PAGE_TIMEOUT, catalog_version, item_exists, page_key, record
+
+
+def is_shared(request):
+    # anonymous visitors without a pending message or a cart all get the same page for a catalog version
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated \
+        and settings.GUEST_CART_COOKIE not in request.COOKIES and not get_messages(request)
+
+
+def validators(version):
+    # the version is the nanosecond time of the last Item write
+    return quote_etag(f'catalog-{version}'), version // 10 ** 9
+
+
+def cached_page(request, version):
+    entry = cache.get(page_key(version, request.get_full_path()))
+    if entry is None:
+        record('page', 'misses')
+        return None
+    record('page', 'hits')
+    content, content_type = entry
+    return HttpResponse(content, content_type=content_type)
+
+
+def store_page(request, version, response):
+    # a page that set a cookie or used a CSRF token belongs to one visitor
+    if request.method != 'GET' or response.status_code != 200 or response.cookies \
+            or request.META.get('CSRF_COOKIE_USED'):
+        return
+    cache.set(page_key(version, request.get_full_path()), (response.content, response['Content-Type']),
+              PAGE_TIMEOUT)
+
+
+def finish(request, version, response):
+    if getattr(response, 'is_rendered', True):
+        store_page(request, version, response)
+    else:
+        response.add_post_render_callback(lambda rendered: store_page(request, version, rendered))
+    return add_validators(response, version)
+
+
+def add_validators(response, version):
+    if response.status_code in (200, 304):
+        etag, last_modified = validators(version)
+        response.headers.setdefault('ETag', etag)
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+        patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def prepare(request, kwargs):
+    # None when the page isn't shared, else (catalog version, a 304 or the cached page if either will do)
+    if not is_shared(request):
+        return None
+    version = catalog_version()
+    if 'slug' in kwargs and not item_exists(version, kwargs['slug']):
+        # the catalog-wide validators would answer for an item that isn't there, the view 404s
+        return version, None
+    etag, last_modified = validators(version)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = cached_page(request, version)
+    if response is not None:
+        response = add_validators(response, version)
+    return version, response
+
+
+def catalog_page(view):
+    """
+    Conditional GET and a shared full-page cache for catalog pages seen anonymously. Both
+    are keyed on the catalog version, so any Item write retires them.
+    """
+    async def wrapper_async(request, *args, **kwargs):
+        # the session and the cache block, so the lookup and the store each take a thread hop
+        prepared = await sync_to_async(prepare)(request, kwargs)
+        if prepared is not None and prepared[1] is not None:
+            return prepared[1]
+        response = view(request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            response = await response
+        if prepared is None:
+            return response
+        return await sync_to_async(finish)(request, prepared[0], response)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if in_event_loop():
+            # called from an async view's dispatch
+            return wrapper_async(request, *args, **kwargs)
+        prepared = prepare(request, kwargs)
+        if prepared is None:
+            return view(request, *args, **kwargs)
+        version, response = prepared
+        if response is not None:
+            return response
+        return finish(request, version, view(request, *args, **kwargs))
+    return wrapper
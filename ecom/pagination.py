@@ -0,0 +1,116 @@
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'ecom.pagination'
+# old cursors just start over from the first page
+CURSOR_MAX_AGE = 60 * 60 * 24
+NEXT = 'n'
+PREVIOUS = 'p'
+
+# ?sort= value -> (field, descending)
+SORT_KEYS = {
+    'id': ('id', False),
+    'price': ('price', False),
+    '-price': ('price', True),
+    'title': ('title', False),
+}
+DEFAULT_SORT = 'id'
+
+
+def encode_cursor(direction, position):
+    return signing.dumps([direction, position], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token):
+    # anything we didn't sign ourselves just starts from the first page
+    if not token:
+        return NEXT, None
+    try:
+        direction, position = signing.loads(token, salt=CURSOR_SALT, max_age=CURSOR_MAX_AGE)
+    except (signing.BadSignature, TypeError, ValueError):
+        return NEXT, None
+    if direction not in (NEXT, PREVIOUS):
+        return NEXT, None
+    return direction, position
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def build_page(rows, key, direction, position, per_page):
+    forward = direction == NEXT
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+    if not rows:
+        return CursorPage(rows)
+    has_next = has_more if forward else position is not None
+    has_previous = position is not None if forward else has_more
+    return CursorPage(
+        rows,
+        next_cursor=encode_cursor(NEXT, key(rows[-1])) if has_next else None,
+        previous_cursor=encode_cursor(PREVIOUS, key(rows[0])) if has_previous else None
+    )
+
+
+def paginate_keyset(queryset, cursor=None, per_page=10, sort=DEFAULT_SORT):
+    field, descending = SORT_KEYS.get(sort, SORT_KEYS[DEFAULT_SORT])
+    direction, position = decode_cursor(cursor)
+    # walking backwards flips both the comparison and the ordering
+    descending = descending != (direction == PREVIOUS)
+    lookup = 'lt' if descending else 'gt'
+    prefix = '-' if descending else ''
+    if field == 'id':
+        ordering = [f'{prefix}pk']
+        if position is not None:
+            queryset = queryset.filter(**{f'pk__{lookup}': position[-1]})
+    else:
+        ordering = [f'{prefix}{field}', f'{prefix}pk']
+        if position is not None:
+            value, pk = position
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'pk__{lookup}': pk})
+            )
+    rows = list(queryset.order_by(*ordering)[:per_page + 1])
+
+    def key(obj):
+        return [obj.pk] if field == 'id' else [getattr(obj, field), obj.pk]
+
+    return build_page(rows, key, direction, position, per_page)
+
+
+def page_links(params, page):
+    # querystrings for the previous/next links, keeping the search and sort parameters
+    links = {'previous_query': None, 'next_query': None}
+    if page is None:
+        return links
+    params = params.copy()
+    if isinstance(page, CursorPage):
+        params.pop('page', None)
+        key = 'cursor'
+        steps = {'previous_query': page.previous_cursor, 'next_query': page.next_cursor}
+    else:
+        key = 'page'
+        steps = {
+            'previous_query': page.previous_page_number() if page.has_previous() else None,
+            'next_query': page.next_page_number() if page.has_next() else None
+        }
+    for name, value in steps.items():
+        if value is not None:
+            params[key] = value
+            links[name] = params.urlencode()
+    return links
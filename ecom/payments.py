@@ -0,0 +1,198 @@
+import asyncio
+import functools
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import weakref
+
+import razorpay
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from razorpay.errors import BadRequestError, GatewayError, ServerError
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+ORDER_PATH = '/orders'
+WEBHOOK_EVENTS = ('payment.captured', 'order.paid')
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, GatewayError, ServerError)
+
+_client = None
+_client_lock = threading.Lock()
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class TimeoutSession(requests.Session):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        with metrics.timer('gateway'):
+            return super().request(method, url, **kwargs)
+
+
+class PooledClient(razorpay.Client):
+    # the stock client looks its own version up through pkg_resources on every call
+    @functools.cached_property
+    def version(self):
+        return super()._get_version()
+
+    def _get_version(self):
+        return self.version
+
+
+def gateway_timeout():
+    return settings.RAZORPAY_CONNECT_TIMEOUT, settings.RAZORPAY_READ_TIMEOUT
+
+
+def build_client():
+    session = TimeoutSession(gateway_timeout())
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.RAZORPAY_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return PooledClient(session=session, auth=(settings.KEY_ID, settings.KEY_SECRET),
+                        base_url=settings.RAZORPAY_BASE_URL)
+
+
+def get_client():
+    # one client per process so the session's keep-alive pool is shared by every request
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_client()
+    return _client
+
+
+def reset_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
+
+
+@receiver(setting_changed)
+def reset_on_setting_change(setting, **kwargs):
+    if setting.startswith('RAZORPAY_') or setting in ('KEY_ID', 'KEY_SECRET'):
+        reset_client()
+
+
+def sign(message, secret):
+    return hmac.new(secret.encode(), message.encode() if isinstance(message, str) else message,
+                    hashlib.sha256).hexdigest()
+
+
+def verify_payment_signature(gateway_order_id, payment_id, signature):
+    # checkout signs "order_id|payment_id" with the key secret
+    if not (gateway_order_id and payment_id and signature):
+        return False
+    return hmac.compare_digest(sign(f'{gateway_order_id}|{payment_id}', settings.KEY_SECRET), signature)
+
+
+def verify_webhook_signature(body, signature):
+    # webhooks sign the raw body with their own secret, an unset secret rejects them all
+    if not (settings.RAZORPAY_WEBHOOK_SECRET and signature):
+        return False
+    return hmac.compare_digest(sign(body, settings.RAZORPAY_WEBHOOK_SECRET), signature)
+
+
+def webhook_payment(body):
+    # (gateway order id, payment id) for events that mean the money arrived, else None
+    try:
+        event = json.loads(body)
+        if event.get('event') not in WEBHOOK_EVENTS:
+            return None
+        payment = event['payload']['payment']['entity']
+        return payment['order_id'], payment['id']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def backoff_delay(attempt):
+    # full jitter keeps retrying workers from hitting the gateway in lockstep
+    return random.uniform(0, settings.RAZORPAY_RETRY_BACKOFF * 2 ** attempt)
+
+
+def order_payload(amount, currency, receipt, payment_capture, notes):
+    payload = {
+        'amount': int(amount),
+        'currency': currency,
+        'receipt': receipt,
+        'payment_capture': payment_capture
+    }
+    if notes:
+        payload['notes'] = notes
+    return payload
+
+
+def create_order(amount, currency='INR', receipt='receipt#1', payment_capture='1', notes=None):
+    payload = order_payload(amount, currency, receipt, payment_capture, notes)
+    attempts = settings.RAZORPAY_MAX_RETRIES + 1
+    for attempt in range(attempts):
+        try:
+            return get_client().order.create(payload)
+        except BadRequestError as e:
+            raise PaymentGatewayError(str(e)) from e
+        except RETRYABLE_ERRORS as e:
+            if attempt + 1 == attempts:
+                raise PaymentGatewayError(str(e) or e.__class__.__name__) from e
+            time.sleep(backoff_delay(attempt))
+
+
+def get_async_session():
+    import aiohttp
+
+    # aiohttp sessions are bound to the loop that created them
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        connect, read = gateway_timeout()
+        session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(settings.KEY_ID, settings.KEY_SECRET),
+            connector=aiohttp.TCPConnector(limit=settings.RAZORPAY_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def acreate_order(amount, currency='INR', receipt='receipt#1', payment_capture='1', notes=None):
+    import aiohttp
+
+    payload = order_payload(amount, currency, receipt, payment_capture, notes)
+    url = settings.RAZORPAY_BASE_URL + ORDER_PATH
+    attempts = settings.RAZORPAY_MAX_RETRIES + 1
+    for attempt in range(attempts):
+        try:
+            with metrics.timer('gateway'):
+                async with get_async_session().post(url, json=payload) as response:
+                    body = await response.json(content_type=None)
+            if response.status < 400:
+                return body
+            description = body.get('error', {}).get('description', '') if isinstance(body, dict) else ''
+            if response.status < 500:
+                raise PaymentGatewayError(description or f"HTTP {response.status}")
+            error = PaymentGatewayError(description or f"HTTP {response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = PaymentGatewayError(str(e) or e.__class__.__name__)
+        if attempt + 1 == attempts:
+            raise error
+        await asyncio.sleep(backoff_delay(attempt))
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('ecom_querywatch', default=None)
+# IN lists of different lengths are the same query
+IN_LIST_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+STACK_DEPTH = 8
+# the execute wrappers, which are on every query's stack
+WRAPPER_FILES = {__file__, metrics.__file__}
+
+
+def query_shape(sql):
+    return IN_LIST_RE.sub('(%s, ...)', sql)
+
+
+def app_stack():
+    # the project frames that issued the query, innermost last, without Django's and the wrappers'
+    root = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(root) and 'site-packages' not in frame.filename
+        and frame.filename not in WRAPPER_FILES
+    ]
+    return [f'{os.path.relpath(frame.filename, root)}:{frame.lineno} in {frame.name}'
+            for frame in frames[-STACK_DEPTH:]]
+
+
+class QueryWatch:
+    """
+    The queries of one request or block, grouped by shape: the SQL before parameters are
+    filled in. A shape run repeat_threshold times or more is the signature of an N+1.
+    """
+
+    def __init__(self, repeat_threshold=None, slow_ms=None):
+        self.repeat_threshold = repeat_threshold or settings.QUERY_WATCH_REPEAT_THRESHOLD
+        self.slow_ms = settings.QUERY_WATCH_SLOW_MS if slow_ms is None else slow_ms
+        self.shapes = {}
+        self.slow = []
+        self.count = 0
+        self.time = 0.0
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.time += duration
+        shape = self.shapes.get(query_shape(sql))
+        if shape is None:
+            shape = self.shapes[query_shape(sql)] = {'count': 0, 'time': 0.0, 'stack': app_stack()}
+        shape['count'] += 1
+        shape['time'] += duration
+        if duration * 1000 >= self.slow_ms:
+            self.slow.append({'sql': sql, 'ms': round(duration * 1000, 2), 'stack': app_stack()})
+
+    def repeated(self):
+        return [
+            {'sql': sql, 'count': shape['count'], 'ms': round(shape['time'] * 1000, 2), 'stack': shape['stack']}
+            for sql, shape in self.shapes.items() if shape['count'] >= self.repeat_threshold
+        ]
+
+    def report(self):
+        return {'queries': self.count, 'ms': round(self.time * 1000, 2),
+                'repeated': self.repeated(), 'slow': self.slow}
+
+
+@contextmanager
+def watch_queries(repeat_threshold=None, slow_ms=None):
+    watch = QueryWatch(repeat_threshold, slow_ms)
+    token = _current.set(watch)
+    try:
+        yield watch
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def assert_no_repeated_queries(repeat_threshold=None):
+    # for tests: fails when the block runs any query shape repeat_threshold times or more
+    with watch_queries(repeat_threshold, slow_ms=float('inf')) as watch:
+        yield watch
+    repeated = watch.repeated()
+    if repeated:
+        raise AssertionError('Repeated queries, likely an N+1:\n' + '\n'.join(
+            f"{query['count']}x {query['sql']}\n    " + '\n    '.join(query['stack']) for query in repeated
+        ))
+
+
+def watch_query(execute, sql, params, many, context):
+    watch = _current.get()
+    if watch is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        watch.record(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if watch_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(watch_query)
+
+
+def log_findings(view, path, report):
+    for query in report['repeated']:
+        logger.warning("%s ran %d times in %s (%s), likely an N+1:\n%s\n    %s", view, query['count'], path,
+                       f"{query['ms']} ms", query['sql'], '\n    '.join(query['stack']))
+    for query in report['slow']:
+        logger.warning("Slow query, %s ms in %s (%s):\n%s\n    %s", query['ms'], view, path, query['sql'],
+                       '\n    '.join(query['stack']))
+
+
+def write_report(view, path, report):
+    # one JSON line per flagged request, in a file per view
+    directory = settings.QUERY_WATCH_REPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    entry = {'time': timezone.now().isoformat(), 'view': view, 'path': path, **report}
+    with open(os.path.join(directory, view.replace(':', '-') + '.jsonl'), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# models whose reads can lag behind the primary by a replication interval
+CATALOG_MODELS = {'ecom.item'}
+
+_pinned = ContextVar('ecom_replica_pinned', default=False)
+_wrote = ContextVar('ecom_replica_wrote', default=False)
+_reporting = ContextVar('ecom_replica_reporting', default=False)
+
+
+def replica_alias():
+    return settings.DB_REPLICA_ALIAS or None
+
+
+def start_request(pinned):
+    _pinned.set(pinned)
+    _wrote.set(False)
+
+
+def wrote():
+    return _wrote.get()
+
+
+@contextmanager
+def use_primary():
+    # also a decorator, the cart views use it so they never act on a stale Item
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+@contextmanager
+def use_replica():
+    # every read in the block may go to the replica, for reports that tolerate lag
+    token = _reporting.set(True)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+class ReplicaRouter:
+    # Catalog reads and admin reports go to the replica. Everything else, and every read
+    # of a visitor who wrote something in the last DB_REPLICA_PIN_SECONDS, stays on the
+    # primary, see ecom.middleware.ReplicaPinMiddleware.
+
+    def db_for_read(self, model, **hints):
+        replica = replica_alias()
+        # migrations' historical models live in '__fake__' and have to read what they write
+        if replica is None or _pinned.get() or model.__module__ == '__fake__':
+            return None
+        if _reporting.get() or model._meta.label_lower in CATALOG_MODELS:
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'ecom':
+            _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica is a copy of the primary, rows from either may be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema through replication
+        if db == replica_alias():
+            return False
+        return None
@@ -0,0 +1,54 @@
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import get_script_prefix, reverse
+
+# the characters reverse() leaves unquoted in a path
+SAFE_CHARS = "!$&'()*+,;=/~:@"
+PLACEHOLDER = 'route-slug-placeholder'
+SLUG_ROUTES = []
+
+
+class SlugRoute:
+    # Resolves the route once per script prefix and then only splices slugs into the
+    # resulting path; the finished URLs are kept in a bounded LRU memo.
+
+    def __init__(self, name, maxsize=2048):
+        self.name = name
+        self.templates = {}
+        self.build = lru_cache(maxsize=maxsize)(self.build_url)
+        SLUG_ROUTES.append(self)
+
+    def template(self, prefix):
+        if prefix not in self.templates:
+            head, tail = reverse(self.name, kwargs={'slug': PLACEHOLDER}).split(PLACEHOLDER)
+            self.templates[prefix] = (head, tail)
+        return self.templates[prefix]
+
+    def build_url(self, prefix, slug):
+        head, tail = self.template(prefix)
+        return head + quote(str(slug), safe=SAFE_CHARS) + tail
+
+    def __call__(self, slug):
+        return self.build(get_script_prefix(), slug)
+
+    def clear(self):
+        self.templates.clear()
+        self.build.cache_clear()
+
+
+@receiver(setting_changed)
+def clear_routes(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        for route in SLUG_ROUTES:
+            route.clear()
+
+
+item_detail_url = SlugRoute('ecom:ecom_detail')
+add_to_cart_url = SlugRoute('ecom:add_to_cart')
+remove_from_cart_url = SlugRoute('ecom:remove_from_cart')
+buy_now_url = SlugRoute('ecom:buy_now')
+increase_quantity_url = SlugRoute('ecom:increase_quantity')
+decrease_quantity_url = SlugRoute('ecom:decrease_quantity')
@@ -0,0 +1,114 @@
+import re
+
+from django.db import connection, connections, router
+from django.db.models import Q
+
+from .models import Item, CATEGORY_CHOICES
+from .pagination import PREVIOUS, CursorPage, build_page, decode_cursor, paginate_keyset
+
+SEARCH_TABLE = 'ecom_item_search'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# bm25 column weights for (title, description, category)
+RANK_WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def search_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def tokenize(query):
+    return TOKEN_RE.findall((query or '').lower())
+
+
+def build_match(tokens):
+    # every token has to match, each one as a prefix of an indexed word
+    return ' '.join('"%s"*' % token for token in tokens)
+
+
+def index_item(item):
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [item.pk])
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)",
+            [item.pk, item.title, item.description, item.get_category_display()]
+        )
+
+
+def remove_item(item_id):
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [item_id])
+
+
+def rebuild_index(batch_size=1000):
+    if not search_enabled():
+        return 0
+    categories = dict(CATEGORY_CHOICES)
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        rows = Item.objects.using(connection.alias).order_by('pk').values_list('pk', 'title', 'description', 'category')
+        batch = []
+        for pk, title, description, category in rows.iterator(chunk_size=batch_size):
+            batch.append((pk, title, description, categories.get(category, category)))
+            if len(batch) >= batch_size:
+                cursor.executemany(
+                    f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)",
+                    batch
+                )
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)",
+                batch
+            )
+            count += len(batch)
+    return count
+
+
+def ranked_rows(tokens, limit, direction, position):
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    rank = f"bm25({SEARCH_TABLE}, {weights})"
+    backwards = direction == PREVIOUS
+    op = '<' if backwards else '>'
+    order = 'DESC' if backwards else 'ASC'
+    params = [build_match(tokens)]
+    after = ''
+    if position is not None:
+        after = f" AND ({rank} {op} %s OR ({rank} = %s AND rowid {op} %s))"
+        params += [position[0], position[0], position[1]]
+    # the index is read wherever Item reads go, so it matches the rows fetched for it
+    with connections[router.db_for_read(Item)].cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, {rank} FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s{after} "
+            f"ORDER BY {rank} {order}, rowid {order} LIMIT %s",
+            params + [limit]
+        )
+        return cursor.fetchall()
+
+
+def fallback_queryset(tokens):
+    qs = Item.objects.all()
+    for token in tokens:
+        codes = [code for code, label in CATEGORY_CHOICES if token in label.lower()]
+        qs = qs.filter(Q(title__icontains=token) | Q(description__icontains=token) | Q(category__in=codes))
+    return qs
+
+
+def search_items(query, cursor=None, per_page=10):
+    tokens = tokenize(query)
+    if not tokens:
+        return CursorPage([])
+    if not search_enabled():
+        return paginate_keyset(fallback_queryset(tokens), cursor, per_page)
+    direction, position = decode_cursor(cursor)
+    # one extra row tells us whether there is another page without a COUNT
+    rows = ranked_rows(tokens, per_page + 1, direction, position)
+    page = build_page(rows, lambda row: [row[1], row[0]], direction, position, per_page)
+    items = Item.objects.in_bulk([pk for pk, _ in page.object_list])
+    page.object_list = [items[pk] for pk, _ in page.object_list if pk in items]
+    return page
@@ -0,0 +1,42 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import search, thumbnails
+from .cache import bump_catalog_version, invalidate_card, invalidate_coupons
+from .models import Coupon, Item
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance, **kwargs):
+    search.index_item(instance)
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance, **kwargs):
+    search.remove_item(instance.pk)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def expire_item_fragments(sender, instance, **kwargs):
+    invalidate_card(instance.pk)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Item)
+def make_thumbnails(sender, instance, **kwargs):
+    # resizing takes long enough to hold up an admin save, `manage.py runworker` does it
+    if thumbnails.needs_thumbnails(instance):
+        thumbnails.make_item_thumbnails.delay(instance.pk)
+
+
+@receiver(post_delete, sender=Item)
+def delete_thumbnails(sender, instance, **kwargs):
+    if instance.thumbnails:
+        thumbnails.delete_thumbnails(instance.thumbnails)
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def expire_coupons(sender, instance, **kwargs):
+    invalidate_coupons()
@@ -1,12 +1,17 @@
 from django import template
-from ecom.models import Order
+from ecom.cache import get_cart_count
+from ecom.guest_cart import get_guest_cart
 
 register=template.Library()
 
 @register.filter
 def cart_items_count(user):
     if user.is_authenticated:
-        query=Order.objects.filter(user=user, ordered=False)
-        if query.exists():
-            return query[0].items.count()
-    return 0
\ No newline at end of file
+        return get_cart_count(user)
+    return 0
+
+
+@register.filter
+def guest_cart_count(request):
+    # read from the signed cookie, no query
+    return len(get_guest_cart(request).lines)
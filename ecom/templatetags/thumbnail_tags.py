@@ -0,0 +1,26 @@
+from django import template
+from django.conf import settings
+from django.utils.html import format_html, format_html_join
+
+from ecom.thumbnails import CONTENT_TYPES, SIZES, srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(item, layout, css_class='', lazy=False):
+    # a <picture> with a source per thumbnail format, the last format is the <img> fallback;
+    # the original upload stays as src until the item has thumbnails
+    sizes = SIZES[layout]
+    sources = [(fmt, srcset(item, fmt)) for fmt in settings.THUMBNAIL_FORMATS]
+    sources = [(fmt, value) for fmt, value in sources if value]
+    loading = 'lazy' if lazy else 'eager'
+    if not sources:
+        return format_html('<img src="{}" class="{}" loading="{}" alt="">', item.image.url, css_class, loading)
+    *preferred, (_, fallback) = sources
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" class="{}" loading="{}" alt=""></picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">',
+                         ((CONTENT_TYPES[fmt], value, sizes) for fmt, value in preferred)),
+        item.image.url, fallback, sizes, css_class, loading
+    )
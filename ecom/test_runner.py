@@ -0,0 +1,35 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests against a cache of their own: the default cache is moved to a directory
+    made for the run, so cache.clear() in a test never empties the cache of a dev server on
+    the same machine or of another test run. Redis is swapped for SQLite, its clear() would
+    flush the whole database.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix='ecom-test-cache-')
+        backend = 'sqlite' if settings.CACHE_BACKEND == 'redis' else settings.CACHE_BACKEND
+        locations = {
+            'sqlite': os.path.join(self.cache_dir, 'cache.sqlite3'),
+            'file': os.path.join(self.cache_dir, 'cache'),
+            'locmem': self.cache_dir,
+        }
+        default = dict(settings.CACHES['default'], BACKEND=settings.CACHE_BACKENDS[backend][0],
+                       LOCATION=locations[backend])
+        self.cache_override = override_settings(CACHES=dict(settings.CACHES, default=default))
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
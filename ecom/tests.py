@@ -1,3 +1,1206 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_script_prefix, include, path, reverse, set_script_prefix
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+
+from . import async_views, cart, metrics, querywatch, routers, routes, urls
+from .backends.sqlite_cache import SQLiteCache
+from .cache import card_key, get_cart_count, get_coupon, get_or_compute, lock_key
+from .cards import render_cards
+from .cart import CartService, UnknownItems
+from .fake_gateway import FakeGateway
+from .jobs import claim_jobs, mark_done, run_job, run_jobs, task
+from .models import Address, Coupon, Item, Job, Order, OrderItem, PaymentEvent
+from .orders import finalize_order, get_payment_order, process_payment_events
+from .pagination import CURSOR_MAX_AGE, SORT_KEYS, encode_cursor, paginate_keyset
+from .payments import (PaymentGatewayError, PooledClient, TimeoutSession, acreate_order, close_async_session,
+                       create_order, get_client, reset_client)
+from .search import search_items
+from .templatetags.cart_template_tags import cart_items_count
+
+User = get_user_model()
+
+ASYNC_VIEWS = {
+    'ecom_home': async_views.HomePageView.as_view(),
+    'ecom_detail': async_views.ItemDetailView.as_view(),
+    'ecom_cart': async_views.CartView.as_view(),
+    'increase_quantity': async_views.increase_quantity,
+}
+# the shop URLs with the async views swapped in, for AsyncViewTests
+urlpatterns = [
+    path('', include(([
+        path(str(pattern.pattern), ASYNC_VIEWS.get(pattern.name, pattern.callback), name=pattern.name)
+        for pattern in urls.urlpatterns
+    ], 'ecom')))
+]
+
+
+class ShopUrls:
+    # the shop mounted below /shop/
+    urlpatterns = [path('shop/', include('ecom.urls'))]
+
+
+def create_items(count, prefix='item'):
+    return Item.objects.bulk_create([
+        Item(title=f'{prefix} {i}', price=100 + i, discount_price=(90 + i) if i % 2 else None,
+             category='S', label='P', slug=f'{prefix}-{i}', description=f'{prefix} description',
+             image=f'{prefix}.jpg')
+        for i in range(count)
+    ])
+
+
+def create_cart(user, items, coupon=None):
+    order = Order.objects.create(user=user, ordered_date=timezone.now(), coupon=coupon)
+    order.items.add(*OrderItem.objects.bulk_create([
+        OrderItem(user=user, item=item, quantity=i % 3 + 1) for i, item in enumerate(items)
+    ]))
+    order.update_total()
+    return order
+
+
+class QueryBudgetMixin:
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        with CaptureQueriesContext(connection) as queries:
+            yield queries
+        executed = [query['sql'] for query in queries.captured_queries]
+        self.assertLessEqual(
+            len(executed), limit,
+            f"{len(executed)} queries executed, budget is {limit}:\n" + '\n'.join(executed)
+        )
+
+    def assertNoRepeatedQueries(self, repeat_threshold=None):
+        return querywatch.assert_no_repeated_queries(repeat_threshold)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+class CartPageQueryBudgetTests(QueryBudgetMixin, TestCase):
+    # session, user, order, order items and the default addresses on checkout
+    CART_BUDGET = 4
+    CHECKOUT_BUDGET = 5
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('budget', password='budget-pass')
+        self.client.force_login(self.user)
+        self.coupon = Coupon.objects.create(code='SAVE5', amount=5)
+
+    def fill_cart(self, size):
+        Order.objects.filter(user=self.user).delete()
+        OrderItem.objects.filter(user=self.user).delete()
+        create_cart(self.user, create_items(size, prefix=f'cart{size}'), coupon=self.coupon)
+        # warm the navbar badge so only the page queries are measured
+        self.client.get(reverse('ecom:ecom_cart'))
+
+    def test_cart_page_query_count_does_not_grow_with_cart(self):
+        counts = []
+        for size in (1, 25):
+            self.fill_cart(size)
+            with self.assertMaxQueries(self.CART_BUDGET), self.assertNoRepeatedQueries():
+                counts.append(self.count_queries(reverse('ecom:ecom_cart')))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_checkout_page_query_count_does_not_grow_with_cart(self):
+        counts = []
+        for size in (1, 25):
+            self.fill_cart(size)
+            with self.assertMaxQueries(self.CHECKOUT_BUDGET), self.assertNoRepeatedQueries():
+                counts.append(self.count_queries(reverse('ecom:ecom_checkout')))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_cart_total_matches_line_prices(self):
+        items = create_items(3, prefix='total')
+        order = create_cart(self.user, items, coupon=self.coupon)
+        expected = sum(line.get_final_price() for line in OrderItem.objects.filter(order=order)) - 5
+        self.assertEqual(order.total, expected)
+        self.assertEqual(Order.objects.get(pk=order.pk).get_total(), expected)
+
+
+class CartServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='shopper-pass')
+        self.item = create_items(1, prefix='service')[0]
+        self.service = CartService(self.user)
+
+    def test_add_creates_single_open_order_and_line(self):
+        self.assertEqual(self.service.add(self.item), cart.ADDED)
+        self.assertEqual(self.service.add(self.item), cart.ALREADY_IN_CART)
+        self.assertEqual(Order.objects.filter(user=self.user, ordered=False).count(), 1)
+        self.assertEqual(OrderItem.objects.filter(user=self.user, ordered=False).count(), 1)
+
+    def test_increase_uses_two_queries(self):
+        self.service.add(self.item)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.service.increase(self.item.slug), cart.UPDATED)
+        # the savepoints only exist because TestCase wraps every test in a transaction
+        statements = [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 2)
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.assertEqual(order.total, 2 * self.item.price)
+
+    def test_decrease_removes_last_unit(self):
+        self.service.add(self.item)
+        self.assertEqual(self.service.decrease(self.item.slug), cart.REMOVED)
+        self.assertEqual(self.service.decrease(self.item.slug), cart.NOT_IN_CART)
+        self.assertEqual(Order.objects.get(user=self.user, ordered=False).total, 0)
+
+    def test_missing_cart(self):
+        self.assertEqual(self.service.remove(self.item.slug), cart.NO_CART)
+
+
+class CartCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('badge', password='badge-pass')
+        self.items = create_items(3, prefix='badge')
+        self.service = CartService(self.user)
+        self.service.add(self.items[0])
+
+    def test_badge_count_is_served_from_cache(self):
+        self.assertEqual(cart_items_count(self.user), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_items_count(self.user), 1)
+
+    def test_cart_changes_invalidate_the_count(self):
+        self.assertEqual(get_cart_count(self.user), 1)
+        self.service.add(self.items[1])
+        self.assertEqual(get_cart_count(self.user), 2)
+        self.service.apply({self.items[2].slug: 1})
+        self.assertEqual(get_cart_count(self.user), 3)
+        self.assertEqual(self.service.decrease(self.items[2].slug), cart.REMOVED)
+        self.assertEqual(get_cart_count(self.user), 2)
+        self.assertEqual(self.service.remove(self.items[1].slug), cart.REMOVED)
+        self.assertEqual(get_cart_count(self.user), 1)
+
+    def test_count_does_not_survive_checkout(self):
+        self.assertEqual(get_cart_count(self.user), 1)
+        self.assertTrue(finalize_order(Order.objects.get(user=self.user, ordered=False)))
+        self.assertEqual(get_cart_count(self.user), 0)
+
+
+class CartApiTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('api', password='api-pass')
+        self.client.force_login(self.user)
+        self.items = create_items(12, prefix='api')
+        # quantities 1, 2 and 3
+        self.order = create_cart(self.user, self.items[:3])
+        self.url = reverse('ecom:cart_api')
+
+    def post(self, operations):
+        return self.client.post(self.url, json.dumps({'operations': operations}), content_type='application/json')
+
+    def quantities(self):
+        return dict(OrderItem.objects.filter(order=self.order).values_list('item__slug', 'quantity'))
+
+    def test_batch_is_applied_and_cart_returned(self):
+        first, second, third, new = self.items[:4]
+        self.assertEqual(get_cart_count(self.user), 3)
+        response = self.post([
+            {'slug': first.slug, 'delta': 2}, {'slug': second.slug, 'delta': -2},
+            {'slug': new.slug, 'delta': 1}, {'slug': new.slug, 'delta': 1}, {'slug': third.slug, 'delta': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {first.slug: 3, third.slug: 3, new.slug: 2})
+        data = response.json()
+        self.assertEqual([line['slug'] for line in data['lines']], [first.slug, third.slug, new.slug])
+        self.assertEqual(data['lines'][0]['line_total'], 3 * first.price)
+        self.assertEqual(data['lines'][2]['saved'], 2 * (new.price - new.discount_price))
+        self.assertEqual(data['total'], Order.objects.get(pk=self.order.pk).total)
+        self.assertEqual(data['total'], sum(line['line_total'] for line in data['lines']))
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(get_cart_count(self.user), 3)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        counts = []
+        # both batches change existing lines and add new ones
+        for items in (self.items[2:4], self.items):
+            with CaptureQueriesContext(connection) as queries, self.assertNoRepeatedQueries():
+                self.assertEqual(self.post([{'slug': item.slug, 'delta': 1} for item in items]).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(len(self.quantities()), 12)
+
+    def test_unknown_slug_changes_nothing(self):
+        before = self.quantities()
+        response = self.post([{'slug': self.items[0].slug, 'delta': 1}, {'slug': 'missing', 'delta': 1}])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['slugs'], ['missing'])
+        self.assertEqual(self.quantities(), before)
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.post([{'slug': self.items[0].slug, 'delta': '1'}]).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.client.post(self.url, 'nope', content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def test_emptying_the_cart(self):
+        response = self.post([{'slug': item.slug, 'delta': -5} for item in self.items[:3]])
+        self.assertEqual(response.json(), {'lines': [], 'total': 0, 'count': 0})
+        self.assertEqual(get_cart_count(self.user), 0)
+        self.assertFalse(OrderItem.objects.filter(user=self.user).exists())
+
+
+class GuestCartTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.items = create_items(3, prefix='guest')
+        self.user = User.objects.create_user('guest', password='guest-pass')
+
+    def fill_guest_cart(self):
+        for item in self.items[:2]:
+            self.client.get(item.get_add_to_cart_url())
+        self.client.get(self.items[0].get_increase_quantity_url())
+
+    def test_guest_cart_writes_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.fill_guest_cart()
+        self.assertFalse([query['sql'] for query in queries.captured_queries if not query['sql'].startswith('SELECT')])
+        self.assertFalse(Order.objects.exists() or OrderItem.objects.exists())
+        response = self.client.get(reverse('ecom:ecom_cart'))
+        self.assertContains(response, 'guest 0')
+        self.assertContains(response, 'guest 1')
+        self.assertEqual(response.context['object'].get_total(), 2 * 100 + 91)
+        self.assertContains(self.client.get(reverse('ecom:ecom_home')), '<span id="cart-count" class="badge red z-depth-1 mr-1">2')
+
+    def test_tampered_cookie_is_ignored(self):
+        self.fill_guest_cart()
+        self.client.cookies[settings.GUEST_CART_COOKIE] = 'eyJndWVzdC0yIjo1MH0:forged'
+        response = self.client.get(reverse('ecom:ecom_cart'))
+        self.assertRedirects(response, reverse('ecom:ecom_home'), fetch_redirect_response=False)
+
+    def test_login_merges_into_open_order(self):
+        order = create_cart(self.user, self.items[:1])
+        self.fill_guest_cart()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('ecom:ecom_login'), {'username': 'guest', 'password': 'guest-pass'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[settings.GUEST_CART_COOKIE].value, '')
+        lines = dict(OrderItem.objects.filter(order=order).values_list('item__slug', 'quantity'))
+        self.assertEqual(lines, {self.items[0].slug: 3, self.items[1].slug: 1})
+        self.assertEqual(Order.objects.get(pk=order.pk).total, 3 * 100 + 91)
+        # one bulk insert of the new line, whatever the size of the guest cart
+        inserts = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "ecom_orderitem"')]
+        self.assertEqual(len(inserts), 1)
+
+    def login(self):
+        return self.client.post(reverse('ecom:ecom_login'), {'username': 'guest', 'password': 'guest-pass'})
+
+    def test_login_drops_deleted_items(self):
+        self.fill_guest_cart()
+        Item.objects.get(pk=self.items[0].pk).delete()
+        with self.assertLogs('ecom.guest_cart', 'INFO') as logs:
+            response = self.login()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[settings.GUEST_CART_COOKIE].value, '')
+        self.assertIn(self.items[0].slug, logs.output[0])
+        self.assertEqual(list(OrderItem.objects.filter(user=self.user).values_list('item', 'quantity')),
+                         [(self.items[1].pk, 1)])
+
+    def test_failed_merge_does_not_fail_login(self):
+        self.fill_guest_cart()
+        with mock.patch.object(CartService, 'apply', side_effect=UnknownItems({self.items[0].slug})), \
+                self.assertLogs('ecom.guest_cart', 'ERROR') as logs:
+            response = self.login()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[settings.GUEST_CART_COOKIE].value, '')
+        self.assertIn(self.items[1].slug, logs.output[0])
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.user.pk)
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_buy_now_sends_guest_to_login_then_checkout(self):
+        response = self.client.get(self.items[2].get_buy_now_url(), follow=True)
+        self.assertEqual(response.redirect_chain[-1][0], f"/login?next={reverse('ecom:ecom_checkout')}")
+        response = self.client.post(f"/login?next={reverse('ecom:ecom_checkout')}",
+                                    {'username': 'guest', 'password': 'guest-pass'})
+        self.assertRedirects(response, reverse('ecom:ecom_checkout'), fetch_redirect_response=False)
+        self.assertEqual(OrderItem.objects.get(user=self.user).item, self.items[2])
+
+    def test_guest_pages_are_not_shared(self):
+        self.fill_guest_cart()
+        self.client.get(reverse('ecom:ecom_cart'))
+        self.assertContains(self.client.get(reverse('ecom:ecom_home')), 'mr-1">2')
+        self.client.cookies.pop(settings.GUEST_CART_COOKIE)
+        self.assertContains(self.client.get(reverse('ecom:ecom_home')), 'mr-1">0')
+
+    def test_cart_api_for_guests(self):
+        self.fill_guest_cart()
+        response = self.client.post(reverse('ecom:cart_api'), json.dumps({'operations': [
+            {'slug': self.items[0].slug, 'delta': -2}, {'slug': self.items[2].slug, 'delta': 4}
+        ]}), content_type='application/json')
+        data = response.json()
+        self.assertEqual([line['slug'] for line in data['lines']], [self.items[1].slug, self.items[2].slug])
+        self.assertEqual(data['total'], 91 + 4 * 102)
+        self.assertEqual(data['count'], 2)
+
+
+class OrderTotalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('totals', password='totals-pass')
+        # 100 without a discount, 101 discounted to 91
+        self.items = create_items(2, prefix='totals')
+        self.service = CartService(self.user)
+
+    def totals(self):
+        order = Order.objects.with_total().get(user=self.user, ordered=False)
+        return order.total, order.computed_total
+
+    def test_stored_total_follows_line_and_coupon_changes(self):
+        self.service.add(self.items[0])
+        self.assertEqual(self.totals(), (100, 100))
+        self.service.add(self.items[1])
+        self.service.increase(self.items[1].slug)
+        self.assertEqual(self.totals(), (282, 282))
+        self.service.apply({self.items[0].slug: 2, self.items[1].slug: -1})
+        self.assertEqual(self.totals(), (391, 391))
+        order = Order.objects.get(user=self.user, ordered=False)
+        order.coupon = Coupon.objects.create(code='TOTALS', amount=50)
+        order.save()
+        order.update_total()
+        self.assertEqual(self.totals(), (341, 341))
+        self.service.remove(self.items[0].slug)
+        self.assertEqual(self.totals(), (41, 41))
+
+    def test_setting_picks_the_stored_or_computed_total(self):
+        order = create_cart(self.user, self.items[:1])
+        Order.objects.filter(pk=order.pk).update(total=1)
+        with override_settings(ECOM_USE_STORED_ORDER_TOTAL=True):
+            self.assertEqual(Order.objects.get(pk=order.pk).get_total(), 1)
+        with override_settings(ECOM_USE_STORED_ORDER_TOTAL=False):
+            self.assertEqual(Order.objects.get(pk=order.pk).get_total(), 100)
+
+    def test_line_total_subquery_runs_once(self):
+        create_cart(self.user, self.items)
+        with CaptureQueriesContext(connection) as queries:
+            list(Order.objects.with_total())
+        self.assertEqual(queries.captured_queries[0]['sql'].count(f'FROM "{OrderItem._meta.db_table}"'), 1)
+
+
+class FinalizeOrderTests(TestCase):
+    def test_only_the_orders_own_lines_are_marked_ordered(self):
+        buyer = User.objects.create_user('buyer', password='buyer-pass')
+        other = User.objects.create_user('other', password='other-pass')
+        items = create_items(2, prefix='finalize')
+        order = create_cart(buyer, items)
+        other_order = create_cart(other, items)
+
+        self.assertTrue(finalize_order(order, paid=True))
+        self.assertFalse(finalize_order(order))
+
+        order.refresh_from_db()
+        self.assertTrue(order.ordered and order.paid)
+        self.assertEqual(len(order.ref_code), 20)
+        self.assertEqual(order.total, order.get_total())
+        self.assertFalse(order.items.filter(ordered=False).exists())
+        self.assertFalse(other_order.items.filter(ordered=True).exists())
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_connections_are_tuned(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class SQLiteCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {})
+
+    def test_entries_are_shared_between_instances(self):
+        self.cache.set('card', {'html': '<div>'})
+        other = SQLiteCache(self.location, {})
+        self.assertEqual(other.get('card'), {'html': '<div>'})
+        self.assertFalse(other.add('card', 'again'))
+        self.assertEqual(other.get_many(['card', 'missing']), {'card': {'html': '<div>'}})
+
+    def test_incr_and_expiry(self):
+        self.cache.set('hits', 1)
+        self.assertEqual(self.cache.incr('hits', 2), 3)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('gone', 'value', timeout=-1)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertTrue(self.cache.add('gone', 'back'))
+
+    def test_incr_without_returning(self):
+        self.cache.set('hits', 1)
+        with mock.patch('ecom.backends.sqlite_cache.HAS_RETURNING', False):
+            self.assertEqual(self.cache.incr('hits', 2), 3)
+            with self.assertRaises(ValueError):
+                self.cache.incr('missing')
+            self.cache.set('pickled', 'text')
+            with self.assertRaises(ValueError):
+                self.cache.incr('pickled')
+        self.assertEqual(self.cache.get('hits'), 3)
+
+
+class StampedeProtectionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_computes_once(self):
+        self.assertEqual(get_or_compute('stampede', self.compute, 60), 1)
+        self.assertEqual(get_or_compute('stampede', self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_entry_is_served_while_another_process_refreshes(self):
+        cache.set('stampede', ('old', 0.1, 0), 60)
+        cache.add(lock_key('stampede'), 1)
+        self.assertEqual(get_or_compute('stampede', self.compute, 60), 'old')
+        cache.delete(lock_key('stampede'))
+        self.assertEqual(get_or_compute('stampede', self.compute, 60), 1)
+
+    def test_timed_out_wait_leaves_the_other_process_lock(self):
+        cache.add(lock_key('stampede'), 1)
+        with mock.patch('ecom.cache.LOCK_WAIT', 0):
+            self.assertEqual(get_or_compute('stampede', self.compute, 60), 1)
+        self.assertEqual(cache.get(lock_key('stampede')), 1)
+
+    def test_lock_taken_over_after_timeout_is_kept(self):
+        def slow_compute():
+            # our lock expired and another process took it
+            cache.set(lock_key('stampede'), 'theirs')
+            return self.compute()
+
+        self.assertEqual(get_or_compute('stampede', slow_compute, 60), 1)
+        self.assertEqual(cache.get(lock_key('stampede')), 'theirs')
+        cache.delete(lock_key('stampede'))
+        cache.delete('stampede')
+        get_or_compute('stampede', self.compute, 60)
+        self.assertIsNone(cache.get(lock_key('stampede')))
+
+    def test_coupon_lookups_are_cached_until_coupons_change(self):
+        self.assertIsNone(get_coupon('SAVE10'))
+        Coupon.objects.create(code='SAVE10', amount=10)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_coupon('SAVE10').amount, 10)
+            self.assertEqual(get_coupon('SAVE10').amount, 10)
+
+
+def create_item(title, description='plain', category='S', price=100, slug=None):
+    # through save(), so the signals index it
+    return Item.objects.create(title=title, price=price, category=category, label='P',
+                               slug=slug or slugify(title), description=description, image='search.jpg')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def slugs(self, page):
+        return [item.slug for item in page.object_list]
+
+    def test_bm25_ranks_title_matches_first(self):
+        create_item('Plain tee', description='goes with a linen jacket', slug='in-description')
+        create_item('Linen shirt', slug='in-title')
+        self.assertEqual(self.slugs(search_items('linen')), ['in-title', 'in-description'])
+        # every token has to match
+        self.assertEqual(self.slugs(search_items('linen jacket')), ['in-description'])
+
+    def test_prefix_matching(self):
+        create_item('Linen shirt', slug='linen')
+        create_item('Lino print', slug='lino')
+        self.assertEqual(sorted(self.slugs(search_items('lin'))), ['linen', 'lino'])
+        self.assertEqual(self.slugs(search_items('line')), ['linen'])
+        self.assertEqual(self.slugs(search_items('')), [])
+
+    def test_cursor_walks_tied_ranks_both_ways(self):
+        expected = [create_item('Denim jacket', slug=f'denim-{i}').slug for i in range(5)]
+        pages, cursor = [], None
+        while True:
+            page = search_items('denim', cursor, per_page=2)
+            pages.append(self.slugs(page))
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual([slug for slugs in pages for slug in slugs], expected)
+        self.assertEqual(len(pages), 3)
+        previous = search_items('denim', page.previous_cursor, per_page=2)
+        self.assertEqual(self.slugs(previous), pages[1])
+        first = search_items('denim', previous.previous_cursor, per_page=2)
+        self.assertEqual(self.slugs(first), pages[0])
+        self.assertFalse(first.has_previous())
+
+    def test_signals_keep_the_index_current(self):
+        item = create_item('Velvet blazer', slug='velvet')
+        self.assertEqual(self.slugs(search_items('velvet')), ['velvet'])
+        item.title = 'Corduroy blazer'
+        item.save()
+        self.assertEqual(self.slugs(search_items('velvet')), [])
+        self.assertEqual(self.slugs(search_items('corduroy')), ['velvet'])
+        item.delete()
+        self.assertEqual(self.slugs(search_items('blazer')), [])
+
+    def test_icontains_fallback_without_fts(self):
+        create_item('Linen shirt', slug='linen')
+        create_item('Track top', category='SW', slug='track')
+        with mock.patch('ecom.search.search_enabled', return_value=False):
+            self.assertEqual(self.slugs(search_items('INEN')), ['linen'])
+            self.assertEqual(self.slugs(search_items('sport')), ['track'])
+            page = search_items('t', per_page=1)
+            self.assertEqual(self.slugs(page), ['linen'])
+            self.assertEqual(self.slugs(search_items('t', page.next_cursor, per_page=1)), ['track'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # equal prices and titles, so every sort needs the pk tiebreak
+        self.items = Item.objects.bulk_create([
+            Item(title=f'Tie {i % 3}', price=100 * (i % 2 + 1), category='S', label='P', slug=f'tie-{i}',
+                 description='tie', image='tie.jpg')
+            for i in range(7)
+        ])
+
+    def walk(self, sort, per_page=3):
+        pages, cursor = [], None
+        while True:
+            page = paginate_keyset(Item.objects.all(), cursor, per_page, sort)
+            pages.append([item.pk for item in page.object_list])
+            if not page.has_next():
+                return pages, page
+            cursor = page.next_cursor
+
+    def test_next_then_previous_for_every_sort(self):
+        for sort, (field, descending) in SORT_KEYS.items():
+            with self.subTest(sort=sort):
+                prefix = '-' if descending else ''
+                expected = list(Item.objects.order_by(f'{prefix}{field}', f'{prefix}pk').values_list('pk', flat=True))
+                pages, page = self.walk(sort)
+                self.assertEqual([pk for pks in pages for pk in pks], expected)
+                for previous in reversed(pages[:-1]):
+                    page = paginate_keyset(Item.objects.all(), page.previous_cursor, 3, sort)
+                    self.assertEqual([item.pk for item in page.object_list], previous)
+                self.assertFalse(page.has_previous())
+
+    def test_bad_cursors_start_from_the_first_page(self):
+        first = [item.pk for item in paginate_keyset(Item.objects.all(), None, 3).object_list]
+        cursor = paginate_keyset(Item.objects.all(), None, 3).next_cursor
+        with mock.patch('time.time', return_value=time.time() - CURSOR_MAX_AGE - 60):
+            expired = paginate_keyset(Item.objects.all(), None, 3).next_cursor
+        for token in (cursor[:-2] + 'xx', expired, 'garbage', encode_cursor('sideways', [1])):
+            self.assertEqual([item.pk for item in paginate_keyset(Item.objects.all(), token, 3).object_list], first)
+        response = self.client.get(reverse('ecom:ecom_home'), {'cursor': cursor[:-2] + 'xx'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.items[0].get_absolute_url())
+
+    def test_numbered_page_links_still_resolve(self):
+        create_items(8, prefix='more')
+        expected = Item.objects.order_by('-price', '-pk')[10:]
+        response = self.client.get(reverse('ecom:ecom_home'), {'page': 2, 'sort': '-price'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_number'], 2)
+        for item in expected:
+            self.assertContains(response, item.get_absolute_url())
+        self.assertIn('page=1', response.context['previous_query'])
+        self.assertEqual(self.client.get(reverse('ecom:ecom_home'), {'page': 9}).status_code, 404)
+
+
+class CatalogPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.items = create_items(3, prefix='page')
+
+    def test_repeat_visits_are_not_rendered_again(self):
+        url = reverse('ecom:ecom_home')
+        response = self.client.get(url)
+        self.assertContains(response, 'page 2')
+        self.assertIn('Last-Modified', response)
+        self.assertIn('Cookie', response['Vary'])
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertFalse(not_modified.templates)
+
+    def test_item_write_changes_the_validators(self):
+        url = self.items[0].get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        self.items[0].description = 'rewritten'
+        self.items[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'rewritten')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_item_is_not_answered_from_the_catalog_validators(self):
+        response = self.client.get(self.items[0].get_absolute_url())
+        headers = {'HTTP_IF_NONE_MATCH': response['ETag'], 'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}
+        self.assertEqual(self.client.get('/detail/no-such-item/', **headers).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.items[0].get_absolute_url(), **headers).status_code, 304)
+
+    def test_signed_in_pages_are_not_shared(self):
+        user = User.objects.create_user('pages', password='pages-pass')
+        self.client.force_login(user)
+        response = self.client.get(reverse('ecom:ecom_home'))
+        self.assertContains(response, 'Welcome, pages')
+        self.assertNotIn('ETag', response)
+
+
+class SlugRouteTests(TestCase):
+    SLUGS = ['plain', 'with space', 'ünïcode', "a&b+c'd", '50%']
+
+    def setUp(self):
+        self.addCleanup(set_script_prefix, get_script_prefix())
+
+    def test_matches_reverse_for_each_script_prefix(self):
+        for prefix in ('/', '/shop/'):
+            set_script_prefix(prefix)
+            for slug in self.SLUGS:
+                self.assertEqual(routes.item_detail_url(slug), reverse('ecom:ecom_detail', kwargs={'slug': slug}))
+                self.assertEqual(routes.add_to_cart_url(slug), reverse('ecom:add_to_cart', kwargs={'slug': slug}))
+        self.assertTrue(routes.item_detail_url('plain').startswith('/shop/detail/'))
+
+    def test_pages_served_below_a_script_name(self):
+        cache.clear()
+        item = create_items(1, prefix='routed')[0]
+        self.assertEqual(item.get_absolute_url(), f'/detail/{item.slug}/')
+        # WSGIHandler sets the prefix from SCRIPT_NAME, the test client doesn't
+        set_script_prefix('/store/')
+        response = self.client.get(f'/detail/{item.slug}/', SCRIPT_NAME='/store')
+        self.assertContains(response, f'href="/store/add_To_cart/{item.slug}/"')
+        self.assertEqual(item.get_absolute_url(), f'/store/detail/{item.slug}/')
+
+    def test_memo_is_cleared_when_the_urlconf_changes(self):
+        self.assertEqual(routes.item_detail_url('memo'), '/detail/memo/')
+        with override_settings(ROOT_URLCONF=ShopUrls):
+            self.assertEqual(routes.item_detail_url('memo'), '/shop/detail/memo/')
+        self.assertEqual(routes.item_detail_url('memo'), '/detail/memo/')
+
+
+class CardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.items = create_items(3, prefix='card')
+
+    def test_cards_are_read_with_one_get_many(self):
+        html = render_cards(self.items)
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch('ecom.cards.render_to_string') as render:
+            self.assertEqual(render_cards(self.items), html)
+        get_many.assert_called_once_with([card_key(item.pk) for item in self.items])
+        render.assert_not_called()
+
+    def test_item_write_expires_only_its_card(self):
+        render_cards(self.items)
+        first, second, third = self.items
+        first.title = 'card renamed'
+        first.save()
+        second.delete()
+        cached = cache.get_many([card_key(item.pk) for item in self.items])
+        self.assertEqual(set(cached), {card_key(third.pk)})
+        self.assertIn('card renamed', render_cards([first, third]))
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name, THUMBNAIL_WIDTHS=[240, 480, 960],
+                                              THUMBNAIL_FORMATS=['webp', 'jpeg'])
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media = media.name
+
+    def upload(self, name, size):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_upload_gets_thumbnails_and_srcset(self):
+        item = create_items(1, prefix='thumb')[0]
+        item.image = self.upload('shirt.png', (600, 400))
+        item.save()
+        self.assertEqual(run_jobs(), 1)
+        item.refresh_from_db()
+        self.assertEqual(item.thumbnails, {'source': 'shirt.png', 'webp': [240, 480], 'jpeg': [240, 480]})
+        with default_storage.open('thumbnails/shirt-240w.webp') as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (240, 160))
+        response = self.client.get(reverse('ecom:ecom_home'))
+        self.assertContains(response, '<source type="image/webp" srcset="/media_root/thumbnails/shirt-240w.webp 240w, '
+                                      '/media_root/thumbnails/shirt-480w.webp 480w"')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_backfill_command(self):
+        items = create_items(2, prefix='backfill')
+        Item.objects.filter(pk=items[0].pk).update(image=self.upload('small.png', (100, 100)))
+        stderr = StringIO()
+        call_command('make_thumbnails', stdout=StringIO(), stderr=stderr)
+        self.assertIn('backfill.jpg', stderr.getvalue())
+        self.assertEqual(Item.objects.get(pk=items[0].pk).thumbnails['jpeg'], [100])
+        self.assertTrue(default_storage.exists('thumbnails/small-100w.jpeg'))
+
+
+@task(max_attempts=2)
+def flaky_task(path):
+    # fails until the file exists, for JobTests
+    with open(path) as f:
+        return f.read()
+
+
+@override_settings(JOB_RETRY_BACKOFF=0, JOB_VISIBILITY_TIMEOUT=60)
+class JobTests(TestCase):
+    def test_failed_job_is_retried_then_given_up(self):
+        job = flaky_task.delay('/nonexistent/flaky')
+        self.assertEqual(run_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('FileNotFoundError', job.error)
+        self.assertEqual(run_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(run_jobs(), 0)
+
+    def test_job_of_a_dead_worker_is_claimed_again(self):
+        flaky_task.delay(__file__)
+        job = claim_jobs(10)[0]
+        self.assertEqual(claim_jobs(10), [])
+        Job.objects.filter(pk=job.pk).update(claimed_at=timezone.now() - timedelta(seconds=61))
+        stale = claim_jobs(10)[0]
+        # the first worker finishing late doesn't count, the second claim does
+        self.assertFalse(mark_done(job))
+        self.assertTrue(run_job(stale))
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_runworker_drains_the_queues(self):
+        items = create_items(1, prefix='worker')
+        order = create_cart(User.objects.create_user('worker'), items)
+        finalize_order(order, paid=True)
+        stdout = StringIO()
+        call_command('runworker', processes=1, once=True, stdout=stdout)
+        self.assertIn('1 jobs processed', stdout.getvalue())
+        self.assertEqual(Item.objects.get().units_sold, 1)
+
+
+class SeedAndBenchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_catalog(self):
+        call_command('seed_catalog', items=12, users=4, orders=6, lines=3, coupons=2, stdout=StringIO())
+        self.assertEqual(Item.objects.count(), 12)
+        self.assertEqual(Order.objects.filter(ordered=False).count(), 2)
+        self.assertEqual(Order.objects.filter(ordered=True).count(), 6)
+        self.assertEqual(OrderItem.objects.count(), 24)
+        for order in Order.objects.with_total():
+            self.assertEqual(order.items.count(), 3)
+            self.assertEqual(order.total, order.computed_total)
+        user = User.objects.get(username='seed-user-0')
+        self.assertTrue(user.check_password('seed-pass'))
+        self.assertEqual(user.address_set.filter(default=True).count(), 2)
+
+    def test_bench_writes_a_baseline(self):
+        call_command('seed_catalog', items=10, users=1, stdout=StringIO())
+        with tempfile.NamedTemporaryFile(suffix='.json') as baseline:
+            call_command('bench', iterations=2, warmup=1, output=baseline.name, stdout=StringIO())
+            with open(baseline.name) as f:
+                scenarios = json.load(f)['scenarios']
+            self.assertEqual(set(scenarios), {'home', 'home_signed_in', 'detail', 'search', 'cart', 'add_remove',
+                                              'increase_decrease', 'checkout'})
+            self.assertLessEqual(scenarios['cart']['queries'], CartPageQueryBudgetTests.CART_BUDGET)
+            call_command('bench', iterations=2, warmup=0, scenarios=['cart'], compare=baseline.name,
+                         tolerance=100, stdout=StringIO())
+
+    def test_bench_order_total_with_default_sizes(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('bench_order_total', stdout=stdout, stderr=stderr)
+        self.assertEqual([line.split()[0] for line in stdout.getvalue().splitlines()[1:]], ['1', '50', '500'])
+        self.assertEqual(stderr.getvalue(), '')
+        # everything is rolled back
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(METRICS_SAMPLE_RATE=1, METRICS_SERVER_TIMING=True, METRICS_TOKEN='scrape-token')
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        # earlier tests' samples go to the cache that is cleared here
+        metrics.flush()
+        cache.clear()
+        self.user = User.objects.create_user('metrics', password='metrics-pass')
+        self.client.force_login(self.user)
+        create_cart(self.user, create_items(2, prefix='metrics'))
+
+    def test_server_timing_and_prometheus_export(self):
+        response = self.client.get(reverse('ecom:ecom_cart'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", tpl;dur=')
+        url = reverse('ecom:metrics')
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        export = self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-token').content.decode()
+        self.assertIn('# TYPE ecom_request_duration_seconds histogram', export)
+        self.assertIn('ecom_request_duration_seconds_count{view="ecom:ecom_cart"} 1', export)
+        self.assertIn('ecom_db_queries_bucket{view="ecom:ecom_cart",le="+Inf"} 1', export)
+        self.assertRegex(export, r'ecom_template_duration_seconds_sum\{view="ecom:ecom_cart"\} 0\.0*[1-9]')
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        response = self.client.get(reverse('ecom:ecom_cart'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class QueryWatchTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('watch', password='watch-pass')
+        self.client.force_login(self.user)
+        create_cart(self.user, create_items(5, prefix='watch'))
+
+    def test_n_plus_one_is_caught_with_its_stack(self):
+        with self.assertRaises(AssertionError) as raised, self.assertNoRepeatedQueries():
+            [line.item.title for line in OrderItem.objects.filter(user=self.user)]
+        self.assertIn('5x SELECT', str(raised.exception))
+        self.assertIn('ecom/tests.py', str(raised.exception))
+        # IN lists of any length are one shape
+        with self.assertRaises(AssertionError), self.assertNoRepeatedQueries(repeat_threshold=2):
+            list(Item.objects.filter(pk__in=[1, 2]))
+            list(Item.objects.filter(pk__in=[1, 2, 3]))
+
+    def test_pages_have_no_repeated_queries_with_a_cold_cache(self):
+        for url in (reverse('ecom:ecom_home'), reverse('ecom:ecom_cart'), reverse('ecom:ecom_checkout')):
+            cache.clear()
+            with self.assertNoRepeatedQueries(repeat_threshold=2):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_middleware_logs_and_reports_slow_queries(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(QUERY_WATCH=True, QUERY_WATCH_SLOW_MS=0, QUERY_WATCH_REPORT_DIR=directory), \
+                self.assertLogs('ecom.querywatch', 'WARNING') as logs:
+            response = self.client.get(reverse('ecom:ecom_cart'))
+            with open(os.path.join(directory, 'ecom-ecom_cart.jsonl')) as f:
+                report = json.loads(f.readline())
+        self.assertRegex(response['X-Query-Watch'], r'^(\d+) queries, 0 repeated, \1 slow$')
+        self.assertEqual(report['path'], reverse('ecom:ecom_cart'))
+        self.assertEqual(len(report['slow']), report['queries'])
+        self.assertTrue(any('ecom/views.py' in frame for query in report['slow'] for frame in query['stack']))
+        self.assertIn('Slow query', logs.output[0])
+
+    def test_off_by_default(self):
+        self.assertNotIn('X-Query-Watch', self.client.get(reverse('ecom:ecom_cart')))
+
+
+@override_settings(DB_REPLICA_ALIAS='replica')
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        routers.start_request(pinned=False)
+
+    def test_catalog_reads_go_to_the_replica(self):
+        self.assertEqual(self.router.db_for_read(Item), 'replica')
+        self.assertIsNone(self.router.db_for_read(Order))
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_read(Order), 'replica')
+        self.assertFalse(self.router.allow_migrate('replica', 'ecom'))
+
+    def test_writers_are_pinned_to_the_primary(self):
+        self.assertEqual(self.router.db_for_write(OrderItem), 'default')
+        self.assertTrue(routers.wrote())
+        routers.start_request(pinned=True)
+        self.assertIsNone(self.router.db_for_read(Item))
+
+    def test_cart_mutation_sets_the_pin_cookie(self):
+        user = User.objects.create_user('pinned', password='pinned-pass')
+        item = create_items(1, prefix='pinned')[0]
+        create_cart(user, [item])
+        self.client.force_login(user)
+        response = self.client.get(item.get_increase_quantity_url())
+        self.assertIn('ecom_primary', response.cookies)
+
+
+class GatewayClientTests(SimpleTestCase):
+    def setUp(self):
+        self.gateway = FakeGateway().start()
+        self.addCleanup(self.gateway.stop)
+        settings_override = override_settings(RAZORPAY_BASE_URL=self.gateway.base_url, RAZORPAY_MAX_RETRIES=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(reset_client)
+
+    def recover(self, attempt):
+        # the outage ends once the client backs off, which also skips the wait
+        self.gateway.failure_rate = 0
+        return 0
+
+    def test_server_errors_are_retried(self):
+        self.gateway.failure_rate = 1
+        with mock.patch('ecom.payments.backoff_delay', side_effect=self.recover) as backoff:
+            order = create_order(500)
+        backoff.assert_called_once_with(0)
+        self.assertEqual(self.gateway.orders[order['id']]['amount'], 500)
+
+    async def test_async_server_errors_are_retried(self):
+        self.gateway.failure_rate = 1
+        with mock.patch('ecom.payments.backoff_delay', side_effect=self.recover) as backoff:
+            order = await acreate_order(500)
+        await close_async_session()
+        backoff.assert_called_once_with(0)
+        self.assertIn(order['id'], self.gateway.orders)
+
+    def test_client_errors_are_not_retried(self):
+        with mock.patch('ecom.payments.backoff_delay', return_value=0) as backoff, \
+                mock.patch.object(TimeoutSession, 'request', autospec=True,
+                                  side_effect=TimeoutSession.request) as request:
+            with self.assertRaisesMessage(PaymentGatewayError, 'amount is required'):
+                create_order(0)
+        backoff.assert_not_called()
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(self.gateway.orders, {})
+
+    @override_settings(RAZORPAY_READ_TIMEOUT=0.05, RAZORPAY_MAX_RETRIES=1)
+    def test_read_timeout_raises_instead_of_hanging(self):
+        self.gateway.latency = 1
+        started = time.monotonic()
+        with mock.patch('ecom.payments.backoff_delay', return_value=0) as backoff:
+            with self.assertRaises(PaymentGatewayError):
+                create_order(500)
+        backoff.assert_called_once_with(0)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_client_is_pooled_and_reset_on_setting_change(self):
+        client = get_client()
+        self.assertIs(get_client(), client)
+        self.assertIsInstance(client, PooledClient)
+        with override_settings(RAZORPAY_POOL_SIZE=3):
+            self.assertIsNot(get_client(), client)
+            self.assertEqual(get_client().session.get_adapter(self.gateway.base_url)._pool_maxsize, 3)
+        self.assertIsNot(get_client(), client)
+
+
+@override_settings(KEY_SECRET='test-secret', RAZORPAY_WEBHOOK_SECRET='hook-secret', RAZORPAY_MAX_RETRIES=0)
+class PaymentCallbackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.gateway = FakeGateway(key_secret='test-secret', webhook_secret='hook-secret').start()
+        self.addCleanup(self.gateway.stop)
+        settings_override = override_settings(RAZORPAY_BASE_URL=self.gateway.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(reset_client)
+        self.user = User.objects.create_user('payer', password='payer-pass')
+        self.items = create_items(2, prefix='paid')
+        self.order = create_cart(self.user, self.items)
+        self.callback = self.gateway.pay(get_payment_order(self.order)['id'])
+
+    def test_callback_queues_and_worker_finalizes(self):
+        response = self.client.post(reverse('ecom:payment_success'), self.callback)
+        self.assertEqual(response.status_code, 200)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.ordered)
+        self.assertEqual(PaymentEvent.objects.get().status, PaymentEvent.PENDING)
+
+        self.assertEqual(process_payment_events(), 1)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.ordered and self.order.paid)
+        self.assertEqual(PaymentEvent.objects.get().status, PaymentEvent.DONE)
+        self.assertEqual(process_payment_events(), 0)
+        # the sale is recorded by the job finalize_order queued
+        self.assertEqual(run_jobs(), 1)
+        self.assertEqual(sorted(Item.objects.values_list('units_sold', flat=True)), [1, 2])
+
+    def test_cart_changed_after_payment_is_not_finalized(self):
+        self.client.post(reverse('ecom:payment_success'), self.callback)
+        CartService(self.user).increase(self.items[0].slug)
+        self.assertEqual(process_payment_events(), 1)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.ordered or self.order.paid)
+        event = PaymentEvent.objects.get()
+        self.assertEqual(event.status, PaymentEvent.FAILED)
+        self.assertIn('changed', event.error)
+
+    def test_payment_for_another_gateway_order_is_not_finalized(self):
+        self.client.post(reverse('ecom:payment_success'), self.callback)
+        Order.objects.filter(pk=self.order.pk).update(payment_order_id='order_other')
+        self.assertEqual(process_payment_events(), 1)
+        self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+        event = PaymentEvent.objects.get()
+        self.assertEqual(event.status, PaymentEvent.FAILED)
+        self.assertIn(self.callback['razorpay_order_id'], event.error)
+
+    def test_forged_callback_is_rejected(self):
+        forged = dict(self.callback, razorpay_signature='0' * 64)
+        response = self.client.post(reverse('ecom:payment_success'), forged)
+        self.assertRedirects(response, reverse('ecom:ecom_home'))
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_webhook_and_callback_queue_the_payment_once(self):
+        body, signature = self.gateway.webhook(self.callback['razorpay_payment_id'])
+        url = reverse('ecom:payment_webhook')
+        self.assertEqual(self.client.post(url, body, content_type='application/json',
+                                          HTTP_X_RAZORPAY_SIGNATURE='0' * 64).status_code, 400)
+        self.assertEqual(self.client.post(url, body, content_type='application/json',
+                                          HTTP_X_RAZORPAY_SIGNATURE=signature).status_code, 200)
+        self.client.post(reverse('ecom:payment_success'), self.callback)
+        self.assertEqual(PaymentEvent.objects.get().source, PaymentEvent.WEBHOOK)
+
+
+class PaymentOrderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.gateway = FakeGateway(key_secret='test-secret').start()
+        self.addCleanup(self.gateway.stop)
+        settings_override = override_settings(RAZORPAY_BASE_URL=self.gateway.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(reset_client)
+        self.user = User.objects.create_user('idem', password='idem-pass')
+        self.client.force_login(self.user)
+        self.items = create_items(2, prefix='idem')
+        self.order = create_cart(self.user, self.items)
+        for address_type in ('S', 'B'):
+            Address.objects.create(user=self.user, address_line1='1 Road', address_line2='Block A', country='IN',
+                                   zip='110001', address_type=address_type, default=True)
+
+    def checkout(self):
+        return self.client.post(reverse('ecom:ecom_checkout'), {
+            'use_default_shipping': 'on', 'use_default_billing': 'on', 'payment_options': 'OP'
+        })
+
+    def cart(self):
+        return Order.objects.select_related('coupon').get(pk=self.order.pk)
+
+    def test_unchanged_cart_reuses_the_gateway_order(self):
+        self.checkout()
+        self.checkout()
+        self.assertEqual(len(self.gateway.orders), 1)
+        payment_order_id = self.cart().payment_order_id
+        self.assertIn(payment_order_id, self.gateway.orders)
+        self.assertEqual(get_payment_order(self.cart())['id'], payment_order_id)
+        # the payment page only reads what checkout stored
+        for _ in range(2):
+            response = self.client.get(reverse('ecom:handle_payment', args=[1]))
+            self.assertEqual(response.context['payment']['id'], payment_order_id)
+        self.assertEqual(len(self.gateway.orders), 1)
+
+    def test_changed_quantity_or_coupon_creates_a_new_gateway_order(self):
+        first = get_payment_order(self.cart())
+        key = self.cart().payment_key
+        CartService(self.user).increase(self.items[0].slug)
+        second = get_payment_order(self.cart())
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertNotEqual(self.cart().payment_key, key)
+        Order.objects.filter(pk=self.order.pk).update(coupon=Coupon.objects.create(code='IDEM5', amount=5))
+        Order.objects.filter(pk=self.order.pk).update_totals()
+        third = get_payment_order(self.cart())
+        self.assertNotIn(third['id'], (first['id'], second['id']))
+        self.assertEqual(len(self.gateway.orders), 3)
+        self.assertEqual(third['amount'], round(self.cart().total * 100))
+
+    def test_amount_comes_from_the_stored_cart_total(self):
+        response = self.checkout()
+        expected = round(self.cart().total * 100)
+        self.assertRedirects(response, reverse('ecom:handle_payment', args=[expected]), fetch_redirect_response=False)
+        response = self.client.get(reverse('ecom:handle_payment', args=[1]))
+        self.assertEqual(response.context['amount'], expected)
+        self.assertEqual(self.gateway.orders[self.cart().payment_order_id]['amount'], expected)
+
+    def test_payment_page_after_cart_change_asks_to_confirm_again(self):
+        self.checkout()
+        CartService(self.user).increase(self.items[0].slug)
+        response = self.client.get(reverse('ecom:handle_payment', args=[1]))
+        self.assertRedirects(response, reverse('ecom:ecom_checkout'), fetch_redirect_response=False)
+        self.assertEqual(len(self.gateway.orders), 1)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(TestCase):
+    client_class = AsyncClient
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('async', password='async-pass')
+        self.items = create_items(3, prefix='async')
+
+    async def test_catalog_pages(self):
+        response = await self.client.get(reverse('ecom:ecom_home'))
+        self.assertContains(response, 'async 2')
+        response = await self.client.get(self.items[0].get_absolute_url())
+        self.assertContains(response, self.items[0].get_add_to_cart_url())
+
+    async def test_cache_is_not_used_on_the_event_loop(self):
+        def off_the_loop(method):
+            def check(*args, **kwargs):
+                with self.assertRaises(RuntimeError):
+                    asyncio.get_running_loop()
+                return method(*args, **kwargs)
+            return check
+
+        with mock.patch.multiple(cache, **{name: off_the_loop(getattr(cache, name))
+                                           for name in ('get', 'get_many', 'set', 'add', 'incr')}):
+            for _ in range(2):
+                response = await self.client.get(reverse('ecom:ecom_home'))
+                self.assertContains(response, 'async 2')
+            response = await self.client.get(reverse('ecom:ecom_home'), {'sort': 'price'})
+            self.assertContains(response, 'async 2')
+
+    async def test_conditional_get(self):
+        url = self.items[0].get_absolute_url()
+        response = await self.client.get(url)
+        # AsyncClient in 4.0 takes raw header names
+        response = await self.client.get(url, **{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_guest_cart(self):
+        response = await self.client.get(self.items[1].get_add_to_cart_url())
+        self.assertRedirects(response, reverse('ecom:ecom_cart'), fetch_redirect_response=False)
+        response = await self.client.get(reverse('ecom:ecom_cart'))
+        self.assertContains(response, 'async 1')
+        response = await self.client.get(reverse('ecom:ecom_checkout'))
+        self.assertTrue(response.url.startswith('/login'))
+
+    def fill_cart(self):
+        self.client.force_login(self.user)
+        create_cart(self.user, self.items[:1])
+
+    async def test_cart_mutation(self):
+        await sync_to_async(self.fill_cart)()
+        response = await self.client.get(self.items[0].get_increase_quantity_url())
+        self.assertRedirects(response, reverse('ecom:ecom_cart'), fetch_redirect_response=False)
+        response = await self.client.get(reverse('ecom:ecom_cart'))
+        self.assertContains(response, 'async 0')
+        line = await sync_to_async(OrderItem.objects.get)(user=self.user)
+        self.assertEqual(line.quantity, 2)
@@ -0,0 +1,103 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .cache import bump_catalog_version, invalidate_card
+from .jobs import task
+from .models import Item
+
+THUMBNAIL_DIR = 'thumbnails'
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+# the listing cards are a quarter of the page on desktop, half on tablets
+SIZES = {
+    'card': '(min-width: 992px) 25vw, (min-width: 768px) 50vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+}
+
+
+def thumbnail_name(name, width, fmt):
+    stem = os.path.splitext(name)[0]
+    return f'{THUMBNAIL_DIR}/{stem}-{width}w.{fmt}'
+
+
+def thumbnail_widths(original_width):
+    # never upscale, an image narrower than every width gets one copy at its own size
+    widths = [width for width in sorted(settings.THUMBNAIL_WIDTHS) if width < original_width]
+    return widths or [original_width]
+
+
+def resize(image, width, fmt):
+    height = round(image.height * width / image.width)
+    resized = image.resize((width, height), Image.Resampling.LANCZOS)
+    if fmt == 'jpeg' and resized.mode != 'RGB':
+        resized = resized.convert('RGB')
+    buffer = BytesIO()
+    resized.save(buffer, fmt, quality=settings.THUMBNAIL_QUALITY, optimize=fmt == 'jpeg', progressive=fmt == 'jpeg')
+    return ContentFile(buffer.getvalue())
+
+
+def generate_thumbnails(name, storage=default_storage):
+    """
+    Write the resized copies of the image stored under name and return the widths made
+    for each format. Copies already in storage are kept.
+    """
+    with storage.open(name) as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    widths = thumbnail_widths(image.width)
+    made = {}
+    for fmt in settings.THUMBNAIL_FORMATS:
+        for width in widths:
+            target = thumbnail_name(name, width, fmt)
+            if not storage.exists(target):
+                storage.save(target, resize(image, width, fmt))
+        made[fmt] = widths
+    return made
+
+
+def delete_thumbnails(thumbnails, storage=default_storage):
+    source = thumbnails.get('source')
+    for fmt, widths in thumbnails.items():
+        if fmt == 'source':
+            continue
+        for width in widths:
+            storage.delete(thumbnail_name(source, width, fmt))
+
+
+def needs_thumbnails(item):
+    return bool(item.image) and item.thumbnails.get('source') != item.image.name
+
+
+def update_thumbnails(item):
+    # an update() rather than save(), the post_save receivers would bring us straight back here
+    if item.thumbnails and item.thumbnails.get('source') != item.image.name:
+        delete_thumbnails(item.thumbnails)
+    thumbnails = {'source': item.image.name, **generate_thumbnails(item.image.name)}
+    Item.objects.filter(pk=item.pk).update(thumbnails=thumbnails)
+    item.thumbnails = thumbnails
+    invalidate_card(item.pk)
+    bump_catalog_version()
+    return thumbnails
+
+
+@task()
+def make_item_thumbnails(item_id):
+    # queued by the Item post_save receiver, the image may have changed again since
+    item = Item.objects.filter(pk=item_id).first()
+    if item is not None and needs_thumbnails(item):
+        update_thumbnails(item)
+
+
+def srcset(item, fmt):
+    thumbnails = item.thumbnails
+    if thumbnails.get('source') != item.image.name or fmt not in thumbnails:
+        return ''
+    return ', '.join(
+        f"{default_storage.url(thumbnail_name(item.image.name, width, fmt))} {width}w" for width in thumbnails[fmt]
+    )
@@ -1,23 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 from django.views.generic import TemplateView
 
+# the catalog and cart views have async twins for ASGI deployments
+shop = async_views if settings.ECOM_ASYNC_VIEWS else views
+
 app_name = 'ecom'
 urlpatterns = [
-    path('', views.HomePageView.as_view(), name='ecom_home'),
-    path('detail/<slug>/', views.ItemDetailView.as_view(), name='ecom_detail'),
+    path('', shop.HomePageView.as_view(), name='ecom_home'),
+    path('detail/<slug>/', shop.ItemDetailView.as_view(), name='ecom_detail'),
     path('login', views.LoginPage.as_view(), name='ecom_login'),
     path('signup', views.SignUpPage.as_view(), name='ecom_signup'),
     path('logout', views.LogoutPage.as_view(), name='ecom_logout'),
-    path('cart', views.CartView.as_view(), name='ecom_cart'),
-    path('add_To_cart/<slug>/', views.add_to_cart, name='add_to_cart'),
-    path('buy_now/<slug>/', views.buy_now, name='buy_now'),
-    path('remove_from_cart/<slug>/', views.remove_from_cart, name='remove_from_cart'),
-    path('decrease_quantity/<slug>/', views.decrease_quantity, name='decrease_quantity'),
-    path('increase_quantity/<slug>/', views.increase_quantity, name='increase_quantity'),
+    path('cart', shop.CartView.as_view(), name='ecom_cart'),
+    path('api/cart', views.cart_api, name='cart_api'),
+    path('add_To_cart/<slug>/', shop.add_to_cart, name='add_to_cart'),
+    path('buy_now/<slug>/', shop.buy_now, name='buy_now'),
+    path('remove_from_cart/<slug>/', shop.remove_from_cart, name='remove_from_cart'),
+    path('decrease_quantity/<slug>/', shop.decrease_quantity, name='decrease_quantity'),
+    path('increase_quantity/<slug>/', shop.increase_quantity, name='increase_quantity'),
     path('checkout', views.CheckOutView.as_view(), name='ecom_checkout'),
     path('handle_payment/<int:amount>', views.handle_payment, name='handle_payment'),
     path('payment_success', views.success_payment, name='payment_success'),
+    path('payment_webhook', views.payment_webhook, name='payment_webhook'),
     path('add_coupon', views.AddCouponView.as_view(), name='add_coupon'),
-    path('request_refund', views.RequestRefundView.as_view(), name='request_refund')
+    path('request_refund', views.RequestRefundView.as_view(), name='request_refund'),
+    path('metrics', views.metrics_export, name='metrics')
 ]
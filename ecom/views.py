@@ -1,32 +1,50 @@
+import hmac
+import json
+
 from django.views.generic import CreateView, UpdateView, View, ListView, DeleteView, DetailView
 from django.urls import reverse_lazy, reverse
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.http import HttpResponseRedirect
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, JsonResponse,
+                         QueryDict)
 from django.shortcuts import redirect, render
 from .forms import SignUpForm, CheckoutForm, CouponForm, RefundForm
-from .models import Item, OrderItem, Order, Address, Coupon, Refund
+from .models import Item, OrderItem, Order, Address, Coupon, Refund, PaymentEvent
+from .search import search_items
+from .cache import get_coupon
+from . import metrics
+from .cards import cached_listing, render_cards
+from .pages import catalog_page
+from .pagination import DEFAULT_SORT, SORT_KEYS, page_links, paginate_keyset
+from . import cart
+from .cart import load_cart
+from .guest_cart import cart_for, merge as merge_guest_cart
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.decorators import login_required
-import razorpay
+from .orders import enqueue_payment, finalize_order, get_payment_order, stored_payment_order
+from .routers import use_primary
+from .payments import PaymentGatewayError, verify_payment_signature, verify_webhook_signature, webhook_payment
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.utils.decorators import method_decorator
 from django.conf import settings
-import random
-import string
-
-
-def create_ref_code():
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
 
 
 class LoginPage(SuccessMessageMixin, LoginView):
     template_name = 'ecom/ecom_login.html'
     success_message = "You are successfully logged in!"
 
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        # what was put in the cart before signing in
+        with use_primary():
+            merge_guest_cart(self.request, self.request.user)
+        return response
+
 
 class LogoutPage(LogoutView):
     def get_next_page(self):
@@ -44,129 +62,151 @@ class SignUpPage(CreateView):
     template_name = 'ecom/ecom_signup.html'
 
 
+@method_decorator(catalog_page, name='dispatch')
 class HomePageView(ListView):
     model = Item
     template_name = 'ecom/ecom_home.html'
     paginate_by = 10
 
+    def get(self, request, *args, **kwargs):
+        searched = request.GET.get('searched')
+        if searched:
+            return self.render_search(searched)
+        self.object_list = self.get_queryset()
+        context = cached_listing(request.GET, self.build_listing)
+        return self.render_to_response(context)
+
     def post(self, request, *args, **kwargs):
-        searched = request.POST.get('searched')
-        searched_items = self.get_queryset().filter(title__icontains=searched)
-        return render(request, self.template_name, {'object_list': searched_items})
+        searched = request.POST.get('searched', '')
+        return self.render_search(searched)
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort', DEFAULT_SORT)
+        return sort if sort in SORT_KEYS else DEFAULT_SORT
+
+    def paginate_queryset(self, queryset, page_size):
+        sort = self.get_sort()
+        if self.page_kwarg in self.request.GET:
+            # numbered pages are still served for old links, newer ones use cursors
+            field, descending = SORT_KEYS[sort]
+            prefix = '-' if descending else ''
+            return super().paginate_queryset(queryset.order_by(f'{prefix}{field}', f'{prefix}pk'), page_size)
+        page_obj = paginate_keyset(queryset, self.request.GET.get('cursor'), page_size, sort)
+        return None, page_obj, page_obj.object_list, page_obj.has_other_pages()
+
+    def build_listing(self):
+        _, page_obj, object_list, is_paginated = self.paginate_queryset(self.object_list, self.paginate_by)
+        params = QueryDict(mutable=True)
+        params.update({name: self.request.GET[name] for name in ('sort', 'cursor', 'page') if name in self.request.GET})
+        context = {
+            'cards': render_cards(object_list),
+            'is_paginated': is_paginated,
+            'page_number': getattr(page_obj, 'number', None)
+        }
+        context.update(page_links(params, page_obj))
+        return context
 
+    def render_search(self, searched):
+        page_obj = search_items(searched, self.request.GET.get('cursor'), self.paginate_by)
+        params = self.request.GET.copy()
+        params['searched'] = searched
+        context = {
+            'cards': render_cards(page_obj.object_list),
+            'object_list': page_obj.object_list,
+            'is_paginated': page_obj.has_other_pages(),
+            'searched': searched
+        }
+        context.update(page_links(params, page_obj))
+        return render(self.request, self.template_name, context)
 
+
+@method_decorator(catalog_page, name='dispatch')
 class ItemDetailView(DetailView):
     model = Item
     template_name = 'ecom/ecom_detail.html'
 
 
-@login_required()
+@use_primary()
 def add_to_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_item, created_at = OrderItem.objects.get_or_create(item=item, user=request.user, ordered=False)
-    order_q = Order.objects.filter(user=request.user, ordered=False)
-    if order_q.exists():
-        order = order_q[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.save()
-            return redirect("ecom:ecom_cart")
-        else:
-            order.items.add(order_item)
-            order_item.save()
-            order.save()
-            messages.info(request, "The item has been added to your cart.")
-            return redirect("ecom:ecom_cart")
-    else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(user=request.user, ordered_date=ordered_date)
-        order.items.add(order_item)
-        order.save()
+    result = cart_for(request).add(item)
+    if result == cart.ADDED:
         messages.info(request, "The item has been added to your cart.")
-        return redirect("ecom:ecom_cart")
+    elif result == cart.CART_FULL:
+        messages.info(request, "Your cart is full, please sign in to add more items.")
+    return redirect("ecom:ecom_cart")
 
 
-@login_required
-def remove_from_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_q = Order.objects.filter(user=request.user, ordered=False)
-    if order_q.exists():
-        order = order_q[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(item=item, user=request.user, ordered=False)[0]
-            order.items.remove(order_item)
-            order_item.delete()
-            order.save()
-            messages.info(request, "This item has been removed from your cart.")
-            redirect("ecom:ecom_cart")
-        else:
-            messages.info(request, "This item was not in your cart.")
-            return redirect("ecom:ecom_cart")
-    else:
+@use_primary()
+def report_missing(request, slug, result):
+    get_object_or_404(Item, slug=slug)
+    if result == cart.NO_CART:
         messages.info(request, "You don't have any items in your cart.")
-        return redirect("ecom:ecom_cart")
+    else:
+        messages.info(request, "This item was not in your cart.")
     return redirect("ecom:ecom_cart")
 
 
+@use_primary()
+def remove_from_cart(request, slug):
+    result = cart_for(request).remove(slug)
+    if result == cart.REMOVED:
+        messages.info(request, "This item has been removed from your cart.")
+        return redirect("ecom:ecom_cart")
+    return report_missing(request, slug, result)
+
+
+@use_primary()
 def increase_quantity(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_q = Order.objects.filter(user=request.user, ordered=False)
-    if order_q.exists():
-        order = order_q[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(item=item, user=request.user, ordered=False)[0]
-
-            order_item.quantity += 1
-            order_item.save()
-            order.save()
-            messages.info(request, "The item's quantity has been updated.")
-            return redirect("ecom:ecom_cart")
-        else:
-            messages.info(request, "The item was not in your cart.")
-            return redirect("ecom:ecom_cart")
-    else:
-        messages.info(request, "You don't have any items in your cart.")
+    result = cart_for(request).increase(slug)
+    if result == cart.UPDATED:
+        messages.info(request, "The item's quantity has been updated.")
         return redirect("ecom:ecom_cart")
+    return report_missing(request, slug, result)
 
 
-@login_required
+@use_primary()
 def decrease_quantity(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_q = Order.objects.filter(user=request.user, ordered=False)
-    if order_q.exists():
-        order = order_q[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(item=item, user=request.user, ordered=False)[0]
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-                order.save()
-                messages.info(request, "This item's quantity has been updated.")
-                return redirect("ecom:ecom_cart")
-            else:
-                order.items.remove(order_item)
-                order_item.delete()
-                order.save()
-                messages.info(request, "This item has been removed from your cart.")
-                return redirect("ecom:ecom_cart")
-        else:
-            messages.info(request, "This item was not in your cart.")
-            return redirect("ecom:ecom_cart")
-    else:
-        messages.info(request, "You don't have any items in your cart.")
+    result = cart_for(request).decrease(slug)
+    if result == cart.UPDATED:
+        messages.info(request, "This item's quantity has been updated.")
+        return redirect("ecom:ecom_cart")
+    if result == cart.REMOVED:
+        messages.info(request, "This item has been removed from your cart.")
         return redirect("ecom:ecom_cart")
+    return report_missing(request, slug, result)
 
 
-class CartView(LoginRequiredMixin, View):
+@require_POST
+@use_primary()
+def cart_api(request):
+    # {"operations": [{"slug": ..., "delta": ...}, ...]} applied in one transaction, answered with
+    # the line totals, the order total and the badge count. CSRF protected, send X-CSRFToken.
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': "Send {\"operations\": [{\"slug\": ..., \"delta\": ...}]}."}, status=400)
+    service = cart_for(request)
+    try:
+        service.apply(cart.parse_changes(operations))
+    except cart.UnknownItems as e:
+        return JsonResponse({'error': str(e), 'slugs': sorted(e.slugs)}, status=404)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(cart.cart_summary(service.load()))
+
+
+class CartView(View):
+    # signed-in shoppers' open Order, or the guest cart of an anonymous visitor
     def get(self, *args, **kwargs):
-        try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            context = {
-                'object': order
-            }
-            return render(self.request, 'ecom/ecom_cart_items.html', context)
-        except ObjectDoesNotExist:
+        order = cart_for(self.request).load()
+        if order is None:
             messages.info(self.request, "You have no items in your cart")
             return redirect("ecom:ecom_home")
+        context = {
+            'object': order
+        }
+        return render(self.request, 'ecom/ecom_cart_items.html', context)
 
 
 def is_valid_form(values):
@@ -182,8 +222,7 @@ class CheckOutView(LoginRequiredMixin, View):
 
     def get(self, *args, **kwargs):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            # order_items_count = Order.objects.filter(user=self.request.user, ordered=False)[0].items.count()
+            order = load_cart(self.request.user)
 
             form = CheckoutForm()
             context = {
@@ -193,23 +232,16 @@ class CheckOutView(LoginRequiredMixin, View):
                 'DISPLAY_COUPON_FORM': True
             }
 
-            shipping_address_qs = Address.objects.filter(
-                user=self.request.user,
-                address_type='S',
-                default=True
-            )
-            if shipping_address_qs.exists():
-                context.update(
-                    {'default_shipping_address': shipping_address_qs[0]})
-
-            billing_address_qs = Address.objects.filter(
+            default_addresses = Address.objects.filter(
                 user=self.request.user,
-                address_type='B',
+                address_type__in=['S', 'B'],
                 default=True
-            )
-            if billing_address_qs.exists():
-                context.update(
-                    {'default_billing_address': billing_address_qs[0]})
+            ).order_by('pk')
+            for address in default_addresses:
+                if address.address_type == 'S':
+                    context.setdefault('default_shipping_address', address)
+                elif address.address_type == 'B':
+                    context.setdefault('default_billing_address', address)
 
             return render(self.request, "ecom/ecom_checkout.html", context)
         except ObjectDoesNotExist:
@@ -319,18 +351,18 @@ class CheckOutView(LoginRequiredMixin, View):
                 payment_option = form.cleaned_data.get('payment_options')
 
                 if payment_option == "POD":
-                    order.ordered = True
-                    order.ref_code = create_ref_code()
-                    order_items = OrderItem.objects.all()
-                    order_items.update(ordered=True)
-                    for order_item in order_items:
-                        order_item.save()
-                    order.save()
+                    finalize_order(order)
                     messages.info(self.request, "Thank You! Your order has been placed.")
                     return redirect("ecom:ecom_home")
                 else:
-                    amount = int(order.get_total() * 100)
-                    return redirect("ecom:handle_payment", amount=amount)
+                    # the gateway order is created here, on the POST, so reloading the payment
+                    # page or a browser prefetch of it never calls the gateway
+                    try:
+                        payment = get_payment_order(order)
+                    except PaymentGatewayError:
+                        messages.info(self.request, "The payment gateway is not reachable right now. Please try again.")
+                        return redirect("ecom:ecom_checkout")
+                    return redirect("ecom:handle_payment", amount=payment['amount'])
             else:
                 messages.info(self.request, "Form was not valid")
                 return redirect("ecom:ecom_checkout")
@@ -339,69 +371,65 @@ class CheckOutView(LoginRequiredMixin, View):
             return redirect("ecom:ecom_checkout")
 
 
-@login_required
+@use_primary()
 def buy_now(request, slug):
+    # checkout asks a guest to sign in, which merges the guest cart
     item = get_object_or_404(Item, slug=slug)
-    order_item, created_at = OrderItem.objects.get_or_create(item=item, user=request.user, ordered=False)
-    order_q = Order.objects.filter(user=request.user, ordered=False)
-    if order_q.exists():
-        order = order_q[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.save()
-            return redirect("ecom:ecom_checkout")
-        else:
-            order.items.add(order_item)
-            order_item.save()
-            order.save()
-            return redirect("ecom:ecom_checkout")
-    else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(user=request.user, ordered_date=ordered_date)
-        order.items.add(order_item)
-        order.save()
-        return redirect("ecom:ecom_checkout")
+    cart_for(request).add(item)
+    return redirect("ecom:ecom_checkout")
 
 
 @login_required
 def handle_payment(request, amount):
-    if request.method == "GET":
-        order = Order.objects.get(user=request.user, ordered=False)
-        if order.billing_address:
-            return render(request, "ecom/online_pay.html", {'amount': amount})
-        else:
-            messages.info(request, "You have not added any billing address.")
-            return redirect("ecom:ecom_checkout")
-    if request.method == "POST":
-        client = razorpay.Client(auth=("rzp_test_OQF0zUX3v90kI6", "aiXwvXSIkjkHdPKwJoqaVLzX"))
-        amount = int(amount)
-        currency = "INR"
-        receipt = "receipt#1"
-        payment_capture = "1"
-        payment = client.order.create({
-            'amount': amount,
-            'currency': currency,
-            'receipt': receipt,
-            'payment_capture': payment_capture
-        })
-    return render(request, "ecom/online_pay.html", {'amount': amount})
+    # the URL amount is only kept for old links, the charge always comes from the cart
+    try:
+        order = Order.objects.select_related('coupon').get(user=request.user, ordered=False)
+    except ObjectDoesNotExist:
+        messages.info(request, "You have no items in your cart")
+        return redirect("ecom:ecom_home")
+    if not order.billing_address_id:
+        messages.info(request, "You have not added any billing address.")
+        return redirect("ecom:ecom_checkout")
+    # created by the checkout POST; gone stale when the cart changed after it
+    payment = stored_payment_order(order)
+    if payment is None:
+        messages.info(request, "Your cart has changed, please confirm your order again.")
+        return redirect("ecom:ecom_checkout")
+    return render(request, "ecom/online_pay.html", {'amount': payment['amount'], 'payment': payment})
 
 
 @csrf_exempt
+@require_POST
 def success_payment(request):
-    try:
-        order = Order.objects.filter(user=request.user, ordered=False)[0]
-        order.ordered = True
-        order.paid = True
-        order.ref_code = create_ref_code()
-        order_items = OrderItem.objects.all()
-        order_items.update(ordered=True)
-        for order_item in order_items:
-            order_item.save()
-        order.save()
-        return render(request, "ecom/payment_success.html")
-    except:
-        messages.info(request, "Some error occured. But Don't worry, transaction was successful.")
+    # Checkout posts back from Razorpay's page, the signature takes the place of the CSRF
+    # token. The order is finalized by the payment worker, not in this request.
+    gateway_order_id = request.POST.get('razorpay_order_id', '')
+    payment_id = request.POST.get('razorpay_payment_id', '')
+    if not verify_payment_signature(gateway_order_id, payment_id, request.POST.get('razorpay_signature', '')):
+        messages.info(request, "We could not verify this payment. If you were charged, your order will be "
+                               "confirmed shortly.")
         return redirect("ecom:ecom_home")
+    order = Order.objects.filter(payment_order_id=gateway_order_id).first()
+    if order is None:
+        messages.info(request, "We could not find the order for this payment. Please contact us.")
+        return redirect("ecom:ecom_home")
+    enqueue_payment(order, payment_id, gateway_order_id, PaymentEvent.CALLBACK)
+    return render(request, "ecom/payment_success.html")
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    if not verify_webhook_signature(request.body, request.headers.get('X-Razorpay-Signature', '')):
+        return HttpResponseBadRequest()
+    payment = webhook_payment(request.body)
+    if payment is not None:
+        gateway_order_id, payment_id = payment
+        order = Order.objects.filter(payment_order_id=gateway_order_id).first()
+        if order is not None:
+            enqueue_payment(order, payment_id, gateway_order_id, PaymentEvent.WEBHOOK)
+    # anything else is acknowledged so the gateway doesn't keep retrying it
+    return HttpResponse()
 
 
 class AddCouponView(View):
@@ -413,10 +441,13 @@ class AddCouponView(View):
                 order = Order.objects.get(
                     user=self.request.user, ordered=False)
                 try:
-                    coupon = Coupon.objects.get(code=code)
+                    coupon = get_coupon(code)
+                    if coupon is None:
+                        raise ObjectDoesNotExist
                     if not order.coupon == coupon:
                         order.coupon = coupon
                         order.save()
+                        order.update_total()
                     else:
                         messages.info(self.request, "This coupon-code has already been applied.")
                         return redirect("ecom:ecom_checkout")
@@ -464,3 +495,12 @@ class RequestRefundView(View):
                 messages.info(self.request,
                               "Either this order does not exist or the Reference code entered is incorrect or invalid.")
                 return redirect("ecom:request_refund")
+
+
+def metrics_export(request):
+    # for Prometheus with METRICS_TOKEN as its bearer token, or for staff in a browser
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (request.user.is_staff or token and hmac.compare_digest(authorization, f'Bearer {token}')):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.export(), content_type='text/plain; version=0.0.4; charset=utf-8')